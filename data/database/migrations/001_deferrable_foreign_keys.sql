@@ -0,0 +1,18 @@
+--Foreign keys are checked at commit time, so that the tables of a snapshot
+--can be loaded concurrently on separate connections
+ALTER TABLE stations_details ALTER CONSTRAINT stations_details_station_id_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE stations_details ALTER CONSTRAINT stations_details_timestamp_last_updated_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE stations_live ALTER CONSTRAINT stations_live_station_id_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE stations_live ALTER CONSTRAINT stations_live_timestamp_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_live ALTER CONSTRAINT bikes_live_bike_id_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_live ALTER CONSTRAINT bikes_live_timestamp_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_live ALTER CONSTRAINT bikes_live_station_id_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_details ALTER CONSTRAINT bikes_details_bike_id_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_details ALTER CONSTRAINT bikes_details_timestamp_last_updated_fkey DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_details ALTER CONSTRAINT bikes_details_vehicle_type_id_fkey DEFERRABLE INITIALLY DEFERRED;
+
+--A timestamp is only marked as loaded once the rows of its snapshot are committed,
+--so that a snapshot whose load failed can be loaded again.
+--The timestamps already in the database were loaded by the previous versions.
+ALTER TABLE timestamps ADD COLUMN is_loaded BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE timestamps ALTER COLUMN is_loaded SET DEFAULT FALSE;
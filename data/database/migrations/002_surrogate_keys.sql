@@ -0,0 +1,99 @@
+--Integer surrogate keys for the station and bike ids of the fact tables
+--'stations_live', 'bikes_live' and 'bikes_details'.
+--The string ids remain available through the *_compat views.
+--Run VACUUM FULL on the fact tables afterwards to reclaim the space of the dropped columns.
+ALTER TABLE stations ADD COLUMN station_key INTEGER GENERATED ALWAYS AS IDENTITY UNIQUE;
+ALTER TABLE bikes ADD COLUMN bike_key INTEGER GENERATED ALWAYS AS IDENTITY UNIQUE;
+
+
+--stations_live
+ALTER TABLE stations_live ADD COLUMN station_key INTEGER;
+UPDATE stations_live SET station_key = stations.station_key
+    FROM stations WHERE stations.id = stations_live.station_id;
+ALTER TABLE stations_live ALTER COLUMN station_key SET NOT NULL;
+ALTER TABLE stations_live ADD CONSTRAINT stations_live_station_key_fkey
+    FOREIGN KEY (station_key) REFERENCES stations(station_key) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE stations_live DROP COLUMN station_id;
+
+
+--bikes_live
+ALTER TABLE bikes_live ADD COLUMN bike_key INTEGER;
+ALTER TABLE bikes_live ADD COLUMN station_key INTEGER;
+UPDATE bikes_live SET bike_key = bikes.bike_key
+    FROM bikes WHERE bikes.id = bikes_live.bike_id;
+UPDATE bikes_live SET station_key = stations.station_key
+    FROM stations WHERE stations.id = bikes_live.station_id;
+ALTER TABLE bikes_live ALTER COLUMN bike_key SET NOT NULL;
+ALTER TABLE bikes_live ALTER COLUMN station_key SET NOT NULL;
+ALTER TABLE bikes_live ADD CONSTRAINT bikes_live_bike_key_fkey
+    FOREIGN KEY (bike_key) REFERENCES bikes(bike_key) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_live ADD CONSTRAINT bikes_live_station_key_fkey
+    FOREIGN KEY (station_key) REFERENCES stations(station_key) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_live DROP COLUMN bike_id;
+ALTER TABLE bikes_live DROP COLUMN station_id;
+
+
+--bikes_details
+ALTER TABLE bikes_details ADD COLUMN bike_key INTEGER;
+UPDATE bikes_details SET bike_key = bikes.bike_key
+    FROM bikes WHERE bikes.id = bikes_details.bike_id;
+ALTER TABLE bikes_details ALTER COLUMN bike_key SET NOT NULL;
+ALTER TABLE bikes_details ADD CONSTRAINT bikes_details_bike_key_fkey
+    FOREIGN KEY (bike_key) REFERENCES bikes(bike_key) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE bikes_details DROP COLUMN bike_id;
+
+
+--COMPATIBILITY VIEWS
+--Fact tables store integer surrogate keys: these views expose the original string ids
+--stations_live_compat
+CREATE VIEW stations_live_compat AS
+SELECT
+    stations_live.id,
+    stations.id AS station_id,
+    stations_live.timestamp,
+    stations_live.num_bikes_available,
+    stations_live.num_docks_available,
+    stations_live.is_installed,
+    stations_live.is_renting,
+    stations_live.is_returning,
+    stations_live.last_reported,
+    stations_live.count_vehicle_type_1,
+    stations_live.count_vehicle_type_2,
+    stations_live.count_vehicle_type_4,
+    stations_live.count_vehicle_type_5,
+    stations_live.count_vehicle_type_6,
+    stations_live.count_vehicle_type_7,
+    stations_live.count_vehicle_type_10,
+    stations_live.count_vehicle_type_14,
+    stations_live.count_vehicle_type_15
+FROM stations_live
+JOIN stations ON stations.station_key = stations_live.station_key;
+
+
+--bikes_live_compat
+CREATE VIEW bikes_live_compat AS
+SELECT
+    bikes_live.id,
+    bikes.id AS bike_id,
+    bikes_live.timestamp,
+    bikes_live.lat,
+    bikes_live.lon,
+    bikes_live.is_reserved,
+    bikes_live.is_disabled,
+    bikes_live.last_reported,
+    bikes_live.current_range_meters,
+    stations.id AS station_id
+FROM bikes_live
+JOIN bikes ON bikes.bike_key = bikes_live.bike_key
+JOIN stations ON stations.station_key = bikes_live.station_key;
+
+
+--bikes_details_compat
+CREATE VIEW bikes_details_compat AS
+SELECT
+    bikes_details.id,
+    bikes.id AS bike_id,
+    bikes_details.timestamp_last_updated,
+    bikes_details.vehicle_type_id
+FROM bikes_details
+JOIN bikes ON bikes.bike_key = bikes_details.bike_key;
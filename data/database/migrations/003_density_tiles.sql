@@ -0,0 +1,19 @@
+--Density tiles for map rendering.
+--Fill them for the snapshots already loaded with: database.py build_tiles
+--density_tiles: counts of a grid cell summed over the snapshots of a time bucket (see tiles.py)
+CREATE TABLE density_tiles(
+    bucket BIGINT NOT NULL,
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    free_bikes INTEGER NOT NULL,
+    disabled_bikes INTEGER NOT NULL,
+    station_bikes INTEGER NOT NULL,
+    station_capacity INTEGER NOT NULL,
+    PRIMARY KEY (bucket, cell_x, cell_y)
+);
+
+--density_buckets: number of snapshots aggregated in the tiles of a time bucket
+CREATE TABLE density_buckets(
+    bucket BIGINT PRIMARY KEY,
+    nb_snapshots INTEGER NOT NULL
+);
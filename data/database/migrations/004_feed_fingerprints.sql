@@ -0,0 +1,7 @@
+--Fingerprints of the feeds, to skip the loaders of unchanged feeds
+--feed_fingerprints: content hash of each feed (ignoring 'last_updated') in the last loaded snapshot
+CREATE TABLE feed_fingerprints(
+    feed VARCHAR(255) PRIMARY KEY,
+    fingerprint CHAR(64) NOT NULL,
+    timestamp BIGINT NOT NULL
+);
@@ -1,6 +1,7 @@
 --timestamps
 CREATE TABLE timestamps(
-    timestamp BIGINT PRIMARY KEY
+    timestamp BIGINT PRIMARY KEY,
+    is_loaded BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 
@@ -8,15 +9,16 @@ CREATE TABLE timestamps(
 --stations
 CREATE TABLE stations(
     id VARCHAR(255) NOT NULL PRIMARY KEY,
-    is_active_station BOOLEAN NOT NULL
+    is_active_station BOOLEAN NOT NULL,
+    station_key INTEGER GENERATED ALWAYS AS IDENTITY UNIQUE
 );
 
 
 --stations_details
 CREATE TABLE stations_details(
     id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-    station_id VARCHAR(255) NOT NULL REFERENCES stations(id),
-    timestamp_last_updated BIGINT NOT NULL REFERENCES timestamps(timestamp),
+    station_id VARCHAR(255) NOT NULL REFERENCES stations(id) DEFERRABLE INITIALLY DEFERRED,
+    timestamp_last_updated BIGINT NOT NULL REFERENCES timestamps(timestamp) DEFERRABLE INITIALLY DEFERRED,
     name VARCHAR(255) NOT NULL,
     lat FLOAT(53) NOT NULL,
     lon FLOAT(53) NOT NULL,
@@ -39,8 +41,8 @@ CREATE TABLE stations_details(
 -- stations_live
 CREATE TABLE stations_live(
     id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-    station_id VARCHAR(255) NOT NULL REFERENCES stations(id),
-    timestamp BIGINT NOT NULL REFERENCES timestamps(timestamp),
+    station_key INTEGER NOT NULL REFERENCES stations(station_key) DEFERRABLE INITIALLY DEFERRED,
+    timestamp BIGINT NOT NULL REFERENCES timestamps(timestamp) DEFERRABLE INITIALLY DEFERRED,
     num_bikes_available BIGINT NOT NULL,
     num_docks_available BIGINT NOT NULL,
     is_installed BOOLEAN NOT NULL,
@@ -73,29 +75,115 @@ CREATE TABLE vehicle_types(
 -- bikes
 CREATE TABLE bikes(
     id VARCHAR(255) PRIMARY KEY,
-    is_active_bike BOOLEAN NOT NULL
+    is_active_bike BOOLEAN NOT NULL,
+    bike_key INTEGER GENERATED ALWAYS AS IDENTITY UNIQUE
 );
 
 
 --bikes_live
 CREATE TABLE bikes_live(
     id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-    bike_id VARCHAR(255) NOT NULL REFERENCES bikes(id),
-    timestamp BIGINT NOT NULL REFERENCES timestamps(timestamp),
+    bike_key INTEGER NOT NULL REFERENCES bikes(bike_key) DEFERRABLE INITIALLY DEFERRED,
+    timestamp BIGINT NOT NULL REFERENCES timestamps(timestamp) DEFERRABLE INITIALLY DEFERRED,
     lat FLOAT(53) NOT NULL,
     lon FLOAT(53) NOT NULL,
     is_reserved BOOLEAN NOT NULL,
     is_disabled BOOLEAN NOT NULL,
     last_reported BIGINT NOT NULL,
     current_range_meters BIGINT NOT NULL,
-    station_id VARCHAR(255) NOT NULL REFERENCES stations(id)
+    station_key INTEGER NOT NULL REFERENCES stations(station_key) DEFERRABLE INITIALLY DEFERRED
 );
 
 
 --bikes_changes
 CREATE TABLE bikes_details(
     id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-    bike_id VARCHAR(255) NOT NULL REFERENCES bikes(id),
-    timestamp_last_updated BIGINT NOT NULL REFERENCES timestamps(timestamp),
-    vehicle_type_id BIGINT NOT NULL REFERENCES vehicle_types(id)
+    bike_key INTEGER NOT NULL REFERENCES bikes(bike_key) DEFERRABLE INITIALLY DEFERRED,
+    timestamp_last_updated BIGINT NOT NULL REFERENCES timestamps(timestamp) DEFERRABLE INITIALLY DEFERRED,
+    vehicle_type_id BIGINT NOT NULL REFERENCES vehicle_types(id) DEFERRABLE INITIALLY DEFERRED
+);
+
+
+--COMPATIBILITY VIEWS
+--Fact tables store integer surrogate keys: these views expose the original string ids
+--stations_live_compat
+CREATE VIEW stations_live_compat AS
+SELECT
+    stations_live.id,
+    stations.id AS station_id,
+    stations_live.timestamp,
+    stations_live.num_bikes_available,
+    stations_live.num_docks_available,
+    stations_live.is_installed,
+    stations_live.is_renting,
+    stations_live.is_returning,
+    stations_live.last_reported,
+    stations_live.count_vehicle_type_1,
+    stations_live.count_vehicle_type_2,
+    stations_live.count_vehicle_type_4,
+    stations_live.count_vehicle_type_5,
+    stations_live.count_vehicle_type_6,
+    stations_live.count_vehicle_type_7,
+    stations_live.count_vehicle_type_10,
+    stations_live.count_vehicle_type_14,
+    stations_live.count_vehicle_type_15
+FROM stations_live
+JOIN stations ON stations.station_key = stations_live.station_key;
+
+
+--bikes_live_compat
+CREATE VIEW bikes_live_compat AS
+SELECT
+    bikes_live.id,
+    bikes.id AS bike_id,
+    bikes_live.timestamp,
+    bikes_live.lat,
+    bikes_live.lon,
+    bikes_live.is_reserved,
+    bikes_live.is_disabled,
+    bikes_live.last_reported,
+    bikes_live.current_range_meters,
+    stations.id AS station_id
+FROM bikes_live
+JOIN bikes ON bikes.bike_key = bikes_live.bike_key
+JOIN stations ON stations.station_key = bikes_live.station_key;
+
+
+--bikes_details_compat
+CREATE VIEW bikes_details_compat AS
+SELECT
+    bikes_details.id,
+    bikes.id AS bike_id,
+    bikes_details.timestamp_last_updated,
+    bikes_details.vehicle_type_id
+FROM bikes_details
+JOIN bikes ON bikes.bike_key = bikes_details.bike_key;
+
+
+--DENSITY TILES
+--density_tiles: counts of a grid cell summed over the snapshots of a time bucket (see tiles.py)
+CREATE TABLE density_tiles(
+    bucket BIGINT NOT NULL,
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    free_bikes INTEGER NOT NULL,
+    disabled_bikes INTEGER NOT NULL,
+    station_bikes INTEGER NOT NULL,
+    station_capacity INTEGER NOT NULL,
+    PRIMARY KEY (bucket, cell_x, cell_y)
+);
+
+--density_buckets: number of snapshots aggregated in the tiles of a time bucket
+CREATE TABLE density_buckets(
+    bucket BIGINT PRIMARY KEY,
+    nb_snapshots INTEGER NOT NULL
+);
+
+
+--FEED FINGERPRINTS
+--feed_fingerprints: content hash of each feed (ignoring 'last_updated') in the last loaded snapshot
+CREATE TABLE feed_fingerprints(
+    feed VARCHAR(255) PRIMARY KEY,
+    fingerprint CHAR(64) NOT NULL,
+    timestamp BIGINT NOT NULL
 );
@@ -1,3 +1,6 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
 import json
 import os
 import requests
@@ -61,12 +64,13 @@ class GBFSCollector:
             return None
 
 
-    def save_to_json(self):
+    def save_to_json(self, save_dir: str = None):
         """
         Saves GBFS data to a JSON file with a timestamp in the name.
+        The file is saved in save_dir (DATA_PATH/gbfs_json by default).
         """
         timestamp = self.gbfs_data['gbfs']['last_updated']
-        save_dir = os.path.join(DATA_PATH, 'gbfs_json')
+        save_dir = save_dir or os.path.join(DATA_PATH, 'gbfs_json')
         os.makedirs(save_dir, exist_ok = True)
 
         filename = f'gbfs_data_{timestamp}.json'
@@ -84,16 +88,10 @@ class GBFSCollector:
         """
         Load GBFS data from a JSON file with a specific timestamp
         """
-        filename = f"gbfs_data_{str(timestamp)}.json"
-        load_dir = os.path.join(DATA_PATH, 'gbfs_json')
-        filepath = os.path.join(load_dir, filename)
+        filepath = get_gbfs_json_path(timestamp)
 
         if os.path.isfile(filepath):
-
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            self.gbfs_data = data
+            self.gbfs_data = read_gbfs_json(filepath)
 
         else:
             print(f"The file was not loaded. There is no such file as {filepath}.")
@@ -143,6 +141,17 @@ class GBFSCollector:
               """)
 
 
+    def get_feed_fingerprints(self) -> dict:
+        """Returns the fingerprint of each feed (see get_feed_fingerprint)"""
+        if self.gbfs_data:
+            return {
+                feed_name: get_feed_fingerprint(payload)
+                for feed_name, payload in self.gbfs_data.items()
+                }
+        else:
+            raise Exception("No gbfs data")
+
+
     def get_vehicle_types_df(self):
         """Returns a dataframe with the vehicle types data"""
         if self.gbfs_data:
@@ -213,3 +222,142 @@ class GBFSCollector:
 
         else:
            raise Exception("No gbfs data")
+
+
+def get_feed_fingerprint(payload: dict) -> str:
+    """Returns a stable content hash (SHA-256) of a feed payload, ignoring 'last_updated',
+    so that two snapshots of an unchanged feed have the same fingerprint"""
+    content = {key: value for key, value in payload.items() if key != 'last_updated'}
+    serialized = json.dumps(content, sort_keys = True, separators = (',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def get_gbfs_json_path(timestamp: int, gbfs_dir: str = None) -> str:
+    """Returns the path of the GBFS JSON file with a specific timestamp"""
+    gbfs_dir = gbfs_dir or os.path.join(DATA_PATH, 'gbfs_json')
+    return os.path.join(gbfs_dir, f"gbfs_data_{str(timestamp)}.json")
+
+
+def read_gbfs_json(filepath: str, feeds: list = None) -> dict:
+    """Read a GBFS JSON file
+    Params:
+        filepath (str): Path of the file
+        feeds (list): Names of the feeds to keep ('gbfs' is always kept). All feeds if None
+
+    Returns:
+        gbfs_data (dict): The GBFS data, by feed name
+    """
+
+    with open(filepath, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if feeds is not None:
+        data = {name: payload for name, payload in data.items() if name == 'gbfs' or name in feeds}
+
+    return data
+
+
+def list_gbfs_timestamps(start: int = None, end: int = None, gbfs_dir: str = None) -> list:
+    """Returns the sorted timestamps of the GBFS JSON files
+    Params:
+        start (int): Only timestamps ≥ start (if given)
+        end (int): Only timestamps ≤ end (if given)
+        gbfs_dir (str): Directory of the files (DATA_PATH/gbfs_json by default)
+    """
+
+    gbfs_dir = gbfs_dir or os.path.join(DATA_PATH, 'gbfs_json')
+    gbfs_files_list = [el for el in os.listdir(gbfs_dir) if el.endswith('.json')]
+    timestamps = [int(file.split("_")[-1].split(".")[0]) for file in gbfs_files_list]
+
+    return sorted(
+        ts for ts in timestamps
+        if (start is None or ts >= start) and (end is None or ts <= end)
+        )
+
+
+# Normalized table of each feed
+FEED_TABLES = {
+    'vehicle_types': GBFSCollector.get_vehicle_types_df,
+    'station_status': GBFSCollector.get_station_status_df,
+    'station_information': GBFSCollector.get_station_information_df,
+    'free_bike_status': GBFSCollector.get_free_bikes_status_df
+}
+
+
+def read_snapshot(timestamp: int, feeds: list = None, tables: bool = False, gbfs_dir: str = None):
+    """Read and decode a GBFS JSON file (see iter_snapshots)
+    Params:
+        timestamp (int): Timestamp of the snapshot
+        feeds (list): Names of the feeds to keep ('gbfs' is always kept). All feeds if None
+        tables (bool): If True, return the normalized tables of the feeds instead of the raw data
+        gbfs_dir (str): Directory of the files (DATA_PATH/gbfs_json by default)
+
+    Returns:
+        GBFSCollector with the snapshot in gbfs_data, or dict of DataFrames by feed name if tables is True
+    """
+
+    gbfs = GBFSCollector(load_latest_gbfs = False)
+    gbfs.gbfs_data = read_gbfs_json(get_gbfs_json_path(timestamp, gbfs_dir), feeds)
+
+    if tables:
+        return {
+            feed_name: get_table(gbfs)
+            for feed_name, get_table in FEED_TABLES.items()
+            if feed_name in gbfs.gbfs_data
+            }
+
+    return gbfs
+
+
+def iter_snapshots(
+    start: int = None,
+    end: int = None,
+    feeds: list = None,
+    tables: bool = False,
+    prefetch: int = 8,
+    workers: int = 4,
+    gbfs_dir: str = None,
+    processes: bool = False
+    ):
+    """Iterate over the GBFS JSON files in timestamp order, reading and decoding them
+    ahead on background threads. At most 'prefetch' snapshots are held in memory.
+    JSON decoding and the normalization of the tables hold the GIL: for long scans,
+    processes = True decodes the snapshots in parallel on worker processes instead.
+
+    Params:
+        start (int): Timestamp of the first snapshot (the first file if None)
+        end (int): Timestamp of the last snapshot (the last file if None)
+        feeds (list): Names of the feeds to keep ('gbfs' is always kept). All feeds if None
+        tables (bool): If True, yield the normalized tables of the feeds instead of the raw data
+        prefetch (int): Number of snapshots read ahead
+        workers (int): Number of reading threads
+        gbfs_dir (str): Directory of the files (DATA_PATH/gbfs_json by default)
+        processes (bool): If True, read and decode the files on 'workers' processes instead of threads
+
+    Yields:
+        (timestamp, GBFSCollector) with the snapshot in gbfs_data,
+        or (timestamp, dict of DataFrames by feed name) if tables is True
+    """
+
+    timestamps = list_gbfs_timestamps(start, end, gbfs_dir)
+
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    executor = executor_class(max_workers = workers)
+    pending = deque()
+    next_index = 0
+
+    try:
+        while next_index < len(timestamps) or pending:
+
+            while next_index < len(timestamps) and len(pending) < prefetch:
+                timestamp = timestamps[next_index]
+                pending.append((timestamp, executor.submit(read_snapshot, timestamp, feeds, tables, gbfs_dir)))
+                next_index += 1
+
+            timestamp, future = pending.popleft()
+            yield timestamp, future.result()
+
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait = True)
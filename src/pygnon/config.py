@@ -12,3 +12,17 @@ DATABASE_CONFIG = {
     'port' : os.getenv('DATABASE_PORT')
     }
 DATABASE_SCHEMA = os.getenv('DATABASE_SCHEMA')
+
+# Database loaded by the replay harness (replay.py), distinct from DATABASE_CONFIG
+REPLAY_DATABASE_CONFIG = {
+    'database' : os.getenv('REPLAY_DATABASE_NAME'),
+    'user' : os.getenv('REPLAY_DATABASE_USER', DATABASE_CONFIG['user']),
+    'host' : os.getenv('REPLAY_DATABASE_HOST', DATABASE_CONFIG['host']),
+    'password' : os.getenv('REPLAY_DATABASE_PASSWORD', DATABASE_CONFIG['password']),
+    'port' : os.getenv('REPLAY_DATABASE_PORT', DATABASE_CONFIG['port'])
+    }
+
+# Density tiles: square grid cells of TILE_CELL_DEGREES x TILE_CELL_DEGREES
+# aggregated over time buckets of TILE_BUCKET_SECONDS
+TILE_CELL_DEGREES = 0.005
+TILE_BUCKET_SECONDS = 900
@@ -1,23 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import os
 import sys
+import threading
+import time
 
 import pandas as pd
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
-from pygnon.config import DATA_PATH, DATABASE_CONFIG, DATABASE_SCHEMA
-from pygnon.client import GBFSCollector
+from pygnon.config import DATABASE_CONFIG, DATABASE_SCHEMA, TILE_BUCKET_SECONDS
+from pygnon.client import GBFSCollector, iter_snapshots
+from pygnon.tiles import DENSITY_FEEDS, compute_density_tiles, get_bucket, get_cell_centers, get_cells
 
 
 def with_db_connection(func):
     """Instantiate the connection to the database,
-    commit the transaction and close the connection"""
+    commit the transaction and close the connection.
+    If a cursor is passed, run within its transaction instead:
+    the caller commits and handles the errors"""
 
-    def wrapper(*args, **kwargs):
+    def wrapper(*args, cursor = None, **kwargs):
+
+        if cursor is not None:
+            return func(cursor, *args, **kwargs)
 
         try:
-            conn = psycopg2.connect(**DATABASE_CONFIG)
+            conn = psycopg2.connect(**_database_config)
             cursor = conn.cursor()
             print("✅ Connected to the database!")
 
@@ -36,6 +46,38 @@ def with_db_connection(func):
     return wrapper
 
 
+_connection_pool = None
+_database_config = DATABASE_CONFIG
+
+
+def set_database_config(database_config: dict):
+    """Connect to another database from now on (e.g. for replays), closing the pooled connections
+    and forgetting the surrogate keys cached for the previous database
+    Params:
+        database_config (dict): The connection parameters, as in DATABASE_CONFIG
+    """
+
+    global _connection_pool, _database_config
+
+    if _connection_pool is not None:
+        _connection_pool.closeall()
+        _connection_pool = None
+
+    _database_config = database_config
+    surrogate_keys.clear()
+
+
+def get_connection_pool() -> ThreadedConnectionPool:
+    """Returns the pool of connections shared by the threads loading a snapshot"""
+
+    global _connection_pool
+
+    if _connection_pool is None:
+        _connection_pool = ThreadedConnectionPool(1, len(LOAD_DEPENDENCIES), **_database_config)
+
+    return _connection_pool
+
+
 @with_db_connection
 def create_db(cursor, sql_schema: str = DATABASE_SCHEMA):
     """Create the database from a SQL Schema / SQL file
@@ -119,11 +161,35 @@ def request_db(cursor, query, placeholders: list = None):
 
 
 @with_db_connection
-def insert_into_db(cursor, table_name: str, rows: list):
+def insert_into_db(cursor, table_name: str, rows: list, returning: list = None, ignore_conflicts: bool = False):
+    """Insert rows into a table
+    Params:
+        table_name (str): name of the PostgreSQL table
+        rows (list): List of tuples, in the order of the columns of the table
+        returning (list): Columns whose values are returned for the inserted rows
+        ignore_conflicts (bool): If True, rows conflicting with existing rows are not inserted
+            (nor returned)
 
-    columns = get_table_columns(table_name)
+    Returns:
+        List of tuples with the values of the 'returning' columns (if any)
+    """
+
+    columns = get_table_columns(table_name, cursor = cursor)
 
     column_names = sql.SQL(', ').join(map(sql.Identifier, columns))
+
+    if returning:
+        query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            sql.Identifier(table_name),
+            column_names
+        )
+
+        if ignore_conflicts:
+            query = query + sql.SQL(" ON CONFLICT DO NOTHING")
+
+        query = query + sql.SQL(" RETURNING {}").format(sql.SQL(', ').join(map(sql.Identifier, returning)))
+        return execute_values(cursor, query, rows, fetch = True)
+
     placeholders = sql.SQL(', ').join([sql.Placeholder()] * len(columns))
 
     query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
@@ -132,6 +198,9 @@ def insert_into_db(cursor, table_name: str, rows: list):
         placeholders
     )
 
+    if ignore_conflicts:
+        query = query + sql.SQL(" ON CONFLICT DO NOTHING")
+
     cursor.executemany(query, rows)
 
 
@@ -182,6 +251,23 @@ def update_vehicle_types(cursor, rows: list):
     cursor.executemany(query, row_values)
 
 
+@with_db_connection
+def update_timestamps(cursor, rows: list):
+    """Update 'timestamps' with the new values in rows
+    Params:
+        rows = List of tuples, of the form
+            ('timestamp', 'is_loaded')
+    """
+
+    query = sql.SQL("UPDATE {} SET {} = %s WHERE {} = %s").format(
+        sql.Identifier('timestamps'),
+        sql.Identifier('is_loaded'),
+        sql.Identifier('timestamp')
+    )
+
+    cursor.executemany(query, [(row[1], row[0]) for row in rows])
+
+
 @with_db_connection
 def update_bikes(cursor, rows: list):
     """Update 'bikes' with the new values in rows
@@ -199,20 +285,186 @@ def update_bikes(cursor, rows: list):
     cursor.executemany(query, [(row[1], row[0]) for row in rows])
 
 
-def load_gbfs_timestamps_to_db(gbfs: GBFSCollector):
+@with_db_connection
+def upsert_density_tiles(cursor, rows: list):
+    """Add the counts of rows to the table 'density_tiles'
+    Params:
+        rows = List of tuples, of the form
+            ('bucket', 'cell_x', 'cell_y', 'free_bikes', 'disabled_bikes', 'station_bikes', 'station_capacity')
+    """
+
+    query = """
+        INSERT INTO density_tiles
+            (bucket, cell_x, cell_y, free_bikes, disabled_bikes, station_bikes, station_capacity)
+        VALUES %s
+        ON CONFLICT (bucket, cell_x, cell_y) DO UPDATE
+            SET free_bikes = density_tiles.free_bikes + EXCLUDED.free_bikes,
+                disabled_bikes = density_tiles.disabled_bikes + EXCLUDED.disabled_bikes,
+                station_bikes = density_tiles.station_bikes + EXCLUDED.station_bikes,
+                station_capacity = density_tiles.station_capacity + EXCLUDED.station_capacity
+    """
+
+    execute_values(cursor, query, rows)
+
+
+@with_db_connection
+def upsert_density_buckets(cursor, rows: list):
+    """Add the numbers of snapshots of rows to the table 'density_buckets'
+    Params:
+        rows = List of tuples, of the form
+            ('bucket', 'nb_snapshots')
+    """
+
+    query = """
+        INSERT INTO density_buckets (bucket, nb_snapshots)
+        VALUES %s
+        ON CONFLICT (bucket) DO UPDATE
+            SET nb_snapshots = density_buckets.nb_snapshots + EXCLUDED.nb_snapshots
+    """
+
+    execute_values(cursor, query, rows)
+
+
+@with_db_connection
+def delete_density_tiles(cursor, bucket_start: int, bucket_end: int):
+    """Delete the rows of 'density_tiles' and 'density_buckets' whose time bucket is between bucket_start and bucket_end"""
+    for table_name in ['density_tiles', 'density_buckets']:
+        query = sql.SQL("DELETE FROM {} WHERE bucket >= %s AND bucket <= %s").format(sql.Identifier(table_name))
+        cursor.execute(query, (bucket_start, bucket_end))
+
+
+@with_db_connection
+def upsert_feed_fingerprints(cursor, rows: list):
+    """Insert or update the rows of 'feed_fingerprints'
+    Params:
+        rows = List of tuples, of the form
+            ('feed', 'fingerprint', 'timestamp')
+    """
+
+    query = """
+        INSERT INTO feed_fingerprints (feed, fingerprint, timestamp)
+        VALUES %s
+        ON CONFLICT (feed) DO UPDATE
+            SET fingerprint = EXCLUDED.fingerprint,
+                timestamp = EXCLUDED.timestamp
+    """
+
+    execute_values(cursor, query, rows)
+
+
+@with_db_connection
+def delete_feed_fingerprints(cursor, feeds: list):
+    """Delete the fingerprints of feeds from the table 'feed_fingerprints'"""
+    query = "DELETE FROM feed_fingerprints WHERE feed = ANY(%s)"
+    cursor.execute(query, (list(feeds),))
+
+
+def get_last_feed_fingerprints() -> dict:
+    """Returns the fingerprint of each feed in the last loaded snapshot"""
+    results = request_db('SELECT feed, fingerprint FROM feed_fingerprints')
+
+    if results is None:
+        raise Exception("The table 'feed_fingerprints' could not be read (was the migration 004 applied?)")
+
+    return dict(results['data'])
+
+
+class SurrogateKeyCache:
+    """In-process cache of the integer surrogate keys of the tables 'stations' and 'bikes',
+    used to translate the station and bike ids of the GBFS feeds before writing the fact tables"""
+
+    KEY_COLUMNS = {'stations': 'station_key', 'bikes': 'bike_key'}
+
+
+    def __init__(self):
+        self._keys = {table: {} for table in self.KEY_COLUMNS}
+        self._lock = threading.Lock()
+
+
+    def register(self, table_name: str, rows):
+        """Add (id, key) pairs to the cache"""
+        with self._lock:
+            self._keys[table_name].update((row_id, int(key)) for row_id, key in rows)
+
+
+    def clear(self):
+        """Forget every key (e.g. when the transactions that created them are rolled back)"""
+        with self._lock:
+            for keys in self._keys.values():
+                keys.clear()
+
+
+    def get_keys(self, table_name: str, ids, cursor = None) -> list:
+        """Translate ids into surrogate keys, querying the table for the ids not in cache
+        Params:
+            table_name (str): 'stations' or 'bikes'
+            ids: Iterable of string ids
+            cursor: If given, the missing keys are queried within the transaction of this cursor
+
+        Returns:
+            List of integer keys, in the order of ids
+        """
+
+        ids = list(ids)
+
+        with self._lock:
+            missing_ids = list(set(ids).difference(self._keys[table_name]))
+
+        if missing_ids:
+            query = sql.SQL("SELECT {}, {} FROM {} WHERE {} = ANY(%s)").format(
+                sql.Identifier('id'),
+                sql.Identifier(self.KEY_COLUMNS[table_name]),
+                sql.Identifier(table_name),
+                sql.Identifier('id')
+            )
+            results = request_db(query, [missing_ids], cursor = cursor)
+            self.register(table_name, results['data'])
+
+        with self._lock:
+            keys = self._keys[table_name]
+            unknown_ids = [row_id for row_id in missing_ids if row_id not in keys]
+
+            if unknown_ids:
+                raise KeyError(f"Unknown ids in '{table_name}': {unknown_ids[:10]}")
+
+            return [keys[row_id] for row_id in ids]
+
+
+surrogate_keys = SurrogateKeyCache()
+
+
+def load_gbfs_timestamps_to_db(gbfs: GBFSCollector, cursor = None):
     """Ingest gbfs data to the table 'timestamps'
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
     """
 
     timestamp = gbfs.gbfs_data['gbfs']['last_updated']
-    insert_into_db(table_name = 'timestamps', rows = [(timestamp,)])
+
+    # The timestamp may already be there if a previous load of the snapshot failed
+    insert_into_db(
+        table_name = 'timestamps', rows = [(timestamp, False)], ignore_conflicts = True, cursor = cursor)
 
 
-def load_gbfs_stations_to_db(gbfs: GBFSCollector):
+def load_gbfs_snapshot_loaded_to_db(gbfs: GBFSCollector, cursor = None):
+    """Mark the timestamp of the snapshot as loaded in the table 'timestamps'
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+    """
+
+    timestamp = gbfs.gbfs_data['gbfs']['last_updated']
+    update_timestamps(rows = [(timestamp, True)], cursor = cursor)
+
+
+def load_gbfs_stations_to_db(gbfs: GBFSCollector, cursor = None, update_existing: bool = True):
     """Ingest gbfs data to the table 'stations'
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        update_existing (bool): If False (snapshot older than the last loaded one), only add
+            the missing stations, as inactive, and keep the state of the other stations
     """
 
     station_info_df = gbfs.get_station_information_df()
@@ -222,8 +474,9 @@ def load_gbfs_stations_to_db(gbfs: GBFSCollector):
     # --- I. Query the table 'stations' to compare the current state of the table
     # --- with the data fetched in the API call
     query = "SELECT * FROM stations"
-    results = request_db(query)
+    results = request_db(query, cursor = cursor)
     table_stations_df = pd.DataFrame(data = results['data'], columns = results['columns'])
+    surrogate_keys.register('stations', zip(table_stations_df['id'], table_stations_df['station_key']))
 
     # --- II. Add or Update rows to the table 'stations'
     rows_to_add = []
@@ -255,7 +508,7 @@ def load_gbfs_stations_to_db(gbfs: GBFSCollector):
     # CASE 2
     # => add rows to the table (mark them as active stations)
     ids_in_new_data_and_not_in_table = ids_in_new_data.difference(ids_in_table)
-    new_rows = [(station_id, True) for station_id in ids_in_new_data_and_not_in_table]
+    new_rows = [(station_id, update_existing) for station_id in ids_in_new_data_and_not_in_table]
     rows_to_add.extend(new_rows)
 
     # CASE 3
@@ -270,35 +523,54 @@ def load_gbfs_stations_to_db(gbfs: GBFSCollector):
     rows_to_update.extend(update_rows)
 
     # III. Perform transactions into the database
-    insert_into_db(table_name = 'stations', rows = rows_to_add)
-    update_stations(rows_to_update)
+    new_keys = insert_into_db(
+        table_name = 'stations', rows = rows_to_add, returning = ['id', 'station_key'], cursor = cursor)
+    surrogate_keys.register('stations', new_keys)
+    if update_existing:
+        update_stations(rows_to_update, cursor = cursor)
 
 
-def load_gbfs_stations_live_to_db(gbfs: GBFSCollector):
-    """Ingest gbfs data to the table 'stations_live'
+def get_gbfs_stations_live_rows(gbfs: GBFSCollector, cursor = None) -> list:
+    """Returns the rows of the table 'stations_live' for the snapshot
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the columns and keys are queried within the transaction of this cursor
     """
-    col_names = get_table_columns('stations_live')
-    station_status_df = gbfs.get_station_status_df()[col_names]
+    col_names = get_table_columns('stations_live', cursor = cursor)
+    station_status_df = gbfs.get_station_status_df()
+    station_status_df['station_key'] = surrogate_keys.get_keys(
+        'stations', station_status_df['station_id'], cursor = cursor)
+    station_status_df = station_status_df[col_names]
     station_status_list = station_status_df.to_dict(orient = 'records')
-    rows = [tuple(ss_dict.values()) for ss_dict in station_status_list]
-    insert_into_db(table_name = 'stations_live', rows = rows)
+    return [tuple(ss_dict.values()) for ss_dict in station_status_list]
 
 
-def load_gbfs_stations_details_to_db(gbfs: GBFSCollector):
+def load_gbfs_stations_live_to_db(gbfs: GBFSCollector, cursor = None, rows: list = None):
+    """Ingest gbfs data to the table 'stations_live'
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        rows (list): The rows already returned by get_gbfs_stations_live_rows (optional)
+    """
+    if rows is None:
+        rows = get_gbfs_stations_live_rows(gbfs, cursor = cursor)
+    insert_into_db(table_name = 'stations_live', rows = rows, cursor = cursor)
+
+
+def load_gbfs_stations_details_to_db(gbfs: GBFSCollector, cursor = None):
     """Ingest gbfs data to the table 'stations_details'
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
     """
 
     # Query the table 'stations_details'
     query = "SELECT * FROM stations_details"
-    results = request_db(query)
+    results = request_db(query, cursor = cursor)
     current_rows = [row[1:2] + row[3:] for row in results['data']]  # Ignoring the auto-incremented 'id' and 'timestamp_last_updated'
 
     # Retrieve new row in the gbfs data
-    col_names = get_table_columns('stations_details')
+    col_names = get_table_columns('stations_details', cursor = cursor)
     station_details_df = gbfs.get_station_information_df()[col_names]
     station_details_list = station_details_df.to_dict(orient = 'records')
     rows = [tuple(sd_dict.values()) for sd_dict in station_details_list]
@@ -307,13 +579,16 @@ def load_gbfs_stations_details_to_db(gbfs: GBFSCollector):
     rows_to_add = [row for row in rows if row[0:1] + row[2:] not in current_rows]
 
     if rows_to_add:
-        insert_into_db(table_name = 'stations_details', rows = rows_to_add)
+        insert_into_db(table_name = 'stations_details', rows = rows_to_add, cursor = cursor)
 
 
-def load_gbfs_vehicle_types_to_db(gbfs: GBFSCollector):
+def load_gbfs_vehicle_types_to_db(gbfs: GBFSCollector, cursor = None, update_existing: bool = True):
     """Ingest gbfs data to the table 'vehicle_types'
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        update_existing (bool): If False (snapshot older than the last loaded one),
+            only add the missing vehicle types
     """
 
     #rows_to_add = []
@@ -321,7 +596,7 @@ def load_gbfs_vehicle_types_to_db(gbfs: GBFSCollector):
 
     # Query the table vehicle_types
     query = "SELECT * FROM vehicle_types"
-    results = request_db(query)
+    results = request_db(query, cursor = cursor)
     current_rows = results['data']
     current_rows_ids = [row[0] for row in current_rows]
 
@@ -343,16 +618,19 @@ def load_gbfs_vehicle_types_to_db(gbfs: GBFSCollector):
     rows_to_add = list(other_rows.difference(set(rows_to_update)))
 
     if rows_to_add:
-        insert_into_db(table_name = 'vehicle_types', rows = rows_to_add)
+        insert_into_db(table_name = 'vehicle_types', rows = rows_to_add, cursor = cursor)
 
-    if rows_to_update:
-        update_vehicle_types(rows_to_update)
+    if rows_to_update and update_existing:
+        update_vehicle_types(rows_to_update, cursor = cursor)
 
 
-def load_gbfs_bikes_to_db(gbfs: GBFSCollector):
+def load_gbfs_bikes_to_db(gbfs: GBFSCollector, cursor = None, update_existing: bool = True):
     """Ingest gbfs data to the table 'bikes'
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        update_existing (bool): If False (snapshot older than the last loaded one), only add
+            the missing bikes, as inactive, and keep the state of the other bikes
     """
     free_bikes_status_df = gbfs.get_free_bikes_status_df()
     bikes_df = free_bikes_status_df[['bike_id', 'is_active_bike']].rename(columns = {'bike_id' : 'id'})
@@ -360,9 +638,9 @@ def load_gbfs_bikes_to_db(gbfs: GBFSCollector):
     # --- I. Query the table 'bikes' to compare the current state of the table
     # --- with the data fetched in the API call
     query = "SELECT * FROM bikes"
-    results = request_db(query)
+    results = request_db(query, cursor = cursor)
     table_bikes_df = pd.DataFrame(data = results['data'], columns = results['columns'])
-    table_bikes_df
+    surrogate_keys.register('bikes', zip(table_bikes_df['id'], table_bikes_df['bike_key']))
 
     # --- II. Add or Update rows to the table 'bikes'
     rows_to_add = []
@@ -388,7 +666,7 @@ def load_gbfs_bikes_to_db(gbfs: GBFSCollector):
     # CASE 2
     # => add rows to the table (as active bikes)
     ids_in_new_data_and_not_in_table = ids_in_new_data.difference(ids_in_table)
-    new_rows = [(bike_id, True) for bike_id in ids_in_new_data_and_not_in_table]
+    new_rows = [(bike_id, update_existing) for bike_id in ids_in_new_data_and_not_in_table]
     rows_to_add.extend(new_rows)
 
     # CASE 3
@@ -398,85 +676,367 @@ def load_gbfs_bikes_to_db(gbfs: GBFSCollector):
     rows_to_update.extend(update_rows)
 
     # III. Perform transactions into the database
-    insert_into_db(table_name = 'bikes', rows = rows_to_add)
-    update_bikes(rows_to_update)
+    new_keys = insert_into_db(
+        table_name = 'bikes', rows = rows_to_add, returning = ['id', 'bike_key'], cursor = cursor)
+    surrogate_keys.register('bikes', new_keys)
+    if update_existing:
+        update_bikes(rows_to_update, cursor = cursor)
 
 
-def load_gbfs_bikes_live_to_db(gbfs: GBFSCollector):
-    """Ingest gbfs data to the table 'bikes_live'
+def get_gbfs_bikes_live_rows(gbfs: GBFSCollector, cursor = None) -> list:
+    """Returns the rows of the table 'bikes_live' for the snapshot
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the columns and keys are queried within the transaction of this cursor
     """
-    col_names = get_table_columns('bikes_live')
-    free_bikes_status_df = gbfs.get_free_bikes_status_df()[col_names]
+    col_names = get_table_columns('bikes_live', cursor = cursor)
+    free_bikes_status_df = gbfs.get_free_bikes_status_df()
+    free_bikes_status_df['bike_key'] = surrogate_keys.get_keys(
+        'bikes', free_bikes_status_df['bike_id'], cursor = cursor)
+    free_bikes_status_df['station_key'] = surrogate_keys.get_keys(
+        'stations', free_bikes_status_df['station_id'], cursor = cursor)
+    free_bikes_status_df = free_bikes_status_df[col_names]
     bikes_status_list = free_bikes_status_df.to_dict(orient = 'records')
-    rows = [tuple(bs_dict.values()) for bs_dict in bikes_status_list]
-    insert_into_db(table_name = 'bikes_live', rows = rows)
+    return [tuple(bs_dict.values()) for bs_dict in bikes_status_list]
+
+
+def load_gbfs_bikes_live_to_db(gbfs: GBFSCollector, cursor = None, rows: list = None):
+    """Ingest gbfs data to the table 'bikes_live'
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        rows (list): The rows already returned by get_gbfs_bikes_live_rows (optional)
+    """
+    if rows is None:
+        rows = get_gbfs_bikes_live_rows(gbfs, cursor = cursor)
+    insert_into_db(table_name = 'bikes_live', rows = rows, cursor = cursor)
 
 
-def load_gbfs_bikes_details_to_db(gbfs: GBFSCollector):
+def load_gbfs_bikes_details_to_db(gbfs: GBFSCollector, cursor = None):
     """Ingest gbfs data to the table 'bikes_details'
     Params:
         gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
     """
 
     # Query the table 'bikes_details'
-    query = "SELECT * FROM bikes_details"
-    results = request_db(query)
-    current_rows = [(row[1], row[-1]) for row in results['data']]  # Ignoring the auto-incremented 'id' and 'timestamp_last_updated'
+    query = "SELECT bike_key, vehicle_type_id FROM bikes_details"
+    results = request_db(query, cursor = cursor)
+    current_rows = set(results['data'])  # Ignoring the auto-incremented 'id' and 'timestamp_last_updated'
 
     # Retrieve new row in the gbfs data
-    col_names = get_table_columns('bikes_details')
-    bikes_details_df = gbfs.get_free_bikes_status_df()[col_names]
+    col_names = get_table_columns('bikes_details', cursor = cursor)
+    bikes_details_df = gbfs.get_free_bikes_status_df()
+    bikes_details_df['bike_key'] = surrogate_keys.get_keys(
+        'bikes', bikes_details_df['bike_id'], cursor = cursor)
+    bikes_details_df = bikes_details_df[col_names]
     bikes_details_list = bikes_details_df.to_dict(orient = 'records')
-    rows = [tuple(bd_dict.values()) for bd_dict in bikes_details_list]
 
     # Only add the rows that are not already in the table 'bikes_details' (ignoring 'id' and 'timestamp_last_updated')
-    rows_to_add = [row for row in rows if (row[0], int(row[-1])) not in current_rows]
+    rows_to_add = [
+        tuple(bd_dict.values()) for bd_dict in bikes_details_list
+        if (bd_dict['bike_key'], int(bd_dict['vehicle_type_id'])) not in current_rows
+        ]
 
     if rows_to_add:
-        insert_into_db(table_name = 'bikes_details', rows = rows_to_add)
+        insert_into_db(table_name = 'bikes_details', rows = rows_to_add, cursor = cursor)
 
 
-def load_gbfs_to_db(gbfs_file_timestamp: int):
-    """Ingest gbfs data to all tables of the database
+def get_gbfs_density_tiles_rows(gbfs: GBFSCollector, cursor = None) -> list:
+    """Returns the rows of the table 'density_tiles' for the snapshot
     Params:
-        gbfs (int): The timestamp that identifies the GBFS json file to load into database
+        gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: Not used (the tiles only depend on the snapshot)
     """
+    tiles_df = compute_density_tiles(gbfs)
+    tiles_list = tiles_df.to_dict(orient = 'records')
+    return [tuple(tile_dict.values()) for tile_dict in tiles_list]
 
-    gbfs = GBFSCollector(load_latest_gbfs = False)
-    gbfs.load_json(timestamp = gbfs_file_timestamp)
 
-    timestamps_list = request_db('SELECT timestamp FROM timestamps')['data']
-    timestamps_list = [tp[0] for tp in timestamps_list]
+def load_gbfs_density_tiles_to_db(gbfs: GBFSCollector, cursor = None, rows: list = None):
+    """Add the counts of the snapshot to the table 'density_tiles',
+    and the snapshot to the number of snapshots of its time bucket in 'density_buckets'
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        rows (list): The rows already returned by get_gbfs_density_tiles_rows (optional)
+    """
+    if rows is None:
+        rows = get_gbfs_density_tiles_rows(gbfs)
+    if rows:
+        upsert_density_tiles(rows, cursor = cursor)
 
-    if int(gbfs_file_timestamp) in timestamps_list:
-        print('❌​ This timestamp is already in the database. No operation was performed.')
+    bucket = int(get_bucket(gbfs.gbfs_data['gbfs']['last_updated']))
+    upsert_density_buckets([(bucket, 1)], cursor = cursor)
 
-    else:
-        print("...Loading data into 'timestamps'...")
-        load_gbfs_timestamps_to_db(gbfs)
 
-        print("...Loading into 'stations'")
-        load_gbfs_stations_to_db(gbfs)
+def load_gbfs_feed_fingerprints_to_db(gbfs: GBFSCollector, cursor = None, fingerprints: dict = None):
+    """Store the fingerprints of the feeds of the snapshot in the table 'feed_fingerprints'
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+        cursor: If given, the rows are written within the transaction of this cursor
+        fingerprints (dict): The fingerprints already returned by gbfs.get_feed_fingerprints (optional)
+    """
+    timestamp = gbfs.gbfs_data['gbfs']['last_updated']
+    fingerprints = gbfs.get_feed_fingerprints() if fingerprints is None else fingerprints
+    rows = [(feed, fingerprint, timestamp) for feed, fingerprint in fingerprints.items()]
+    upsert_feed_fingerprints(rows, cursor = cursor)
+
+
+# Feeds read by the loaders whose result only depends on the content of these feeds:
+# these loaders are skipped when their feeds did not change since the last loaded snapshot.
+# A loader deletes the fingerprints of its feeds in its own transaction: they are only
+# written again with the snapshot, so a failed snapshot never leaves a stale fingerprint
+LOADER_FEEDS = {
+    'stations': ['station_information'],
+    'stations_details': ['station_information'],
+    'vehicle_types': ['vehicle_types'],
+    'bikes': ['free_bike_status'],
+    'bikes_details': ['free_bike_status']
+}
+
+
+# Tables referenced by the foreign keys of each table (see schema.sql):
+# a table is loaded once the tables it references are loaded
+LOAD_DEPENDENCIES = {
+    'timestamps': [],
+    'stations': [],
+    'vehicle_types': [],
+    'bikes': [],
+    'stations_live': ['timestamps', 'stations'],
+    'stations_details': ['timestamps', 'stations'],
+    'bikes_live': ['timestamps', 'bikes', 'stations'],
+    'bikes_details': ['timestamps', 'bikes', 'vehicle_types'],
+    'density_tiles': []
+}
+
+# Tables written once per snapshot (a second load would duplicate their rows):
+# their rows are prepared concurrently, then written in a single transaction
+# together with the feed fingerprints and the 'is_loaded' flag of the timestamp
+SNAPSHOT_ROWS = {
+    'stations_live': get_gbfs_stations_live_rows,
+    'bikes_live': get_gbfs_bikes_live_rows,
+    'density_tiles': get_gbfs_density_tiles_rows
+}
+
+# Tables holding the current state of the network: a snapshot older than
+# the last loaded one only adds the missing rows
+STATE_TABLES = ['stations', 'vehicle_types', 'bikes']
+
+LOADERS = {
+    'timestamps': load_gbfs_timestamps_to_db,
+    'stations': load_gbfs_stations_to_db,
+    'vehicle_types': load_gbfs_vehicle_types_to_db,
+    'bikes': load_gbfs_bikes_to_db,
+    'stations_live': load_gbfs_stations_live_to_db,
+    'stations_details': load_gbfs_stations_details_to_db,
+    'bikes_live': load_gbfs_bikes_live_to_db,
+    'bikes_details': load_gbfs_bikes_details_to_db,
+    'density_tiles': load_gbfs_density_tiles_to_db
+}
+
+
+def sort_load_tasks(dependencies: dict = LOAD_DEPENDENCIES) -> list:
+    """Sort the tables so that every table comes after the tables it references
+    Params:
+        dependencies (dict): The tables referenced by each table
+
+    Returns:
+        List of table names
+    """
+
+    ordered_tables = []
+    remaining = dict(dependencies)
+
+    while remaining:
+        ready = [table for table, deps in remaining.items() if all(dep in ordered_tables for dep in deps)]
+
+        if not ready:
+            raise Exception(f"Circular dependencies between the tables {list(remaining)}")
+
+        ordered_tables.extend(ready)
+        for table in ready:
+            del remaining[table]
+
+    return ordered_tables
+
+
+def run_load_tasks(
+    gbfs: GBFSCollector,
+    dependencies: dict = LOAD_DEPENDENCIES,
+    skipped_tables: list = (),
+    update_existing: bool = True,
+    fingerprints: dict = None
+    ) -> dict:
+    """Run the loaders of a snapshot as a DAG: each task runs on its own pooled
+    connection as soon as the tasks of the tables it references are done,
+    so that independent branches (stations side, bikes side) run concurrently.
+
+    The loaders of the reference tables (timestamps, stations, vehicle types, bikes
+    and their details) can run again on the same snapshot without duplicating rows:
+    each one commits as soon as it is done, so that the tables referencing it can be written.
+
+    The rows of SNAPSHOT_ROWS are only prepared by the tasks. Once every task succeeded,
+    they are written with the feed fingerprints and the 'is_loaded' flag of the timestamp
+    in a single transaction: if anything fails, the snapshot is not marked as loaded
+    and can be loaded again.
+
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+        dependencies (dict): The tables referenced by each table
+        skipped_tables (list): Tables whose loaders are not run
+        update_existing (bool): If False (snapshot older than the last loaded one), the loaders
+            of STATE_TABLES only add the missing rows and the feed fingerprints are not updated
+        fingerprints (dict): The fingerprints already returned by gbfs.get_feed_fingerprints (optional)
+
+    Returns:
+        task_seconds (dict): The loading time of each table (skipped tables excluded)
+            and of the snapshot transaction ('snapshot')
+    """
+
+    pool = get_connection_pool()
+    ordered_tables = sort_load_tasks(dependencies)
+    snapshot_rows = {}
+    task_seconds = {}
+
+    def run_task(table: str, futures: dict):
+        for dependency in dependencies[table]:
+            futures[dependency].result()
+
+        if table in skipped_tables:
+            print(f"...Skipped '{table}' (unchanged feed)")
+            return
+
+        conn = pool.getconn()
+        start = time.perf_counter()
+
+        try:
+            with conn.cursor() as cursor:
+                if table in LOADER_FEEDS:
+                    delete_feed_fingerprints(LOADER_FEEDS[table], cursor = cursor)
+
+                if table in SNAPSHOT_ROWS:
+                    snapshot_rows[table] = SNAPSHOT_ROWS[table](gbfs, cursor = cursor)
+                elif table in STATE_TABLES:
+                    LOADERS[table](gbfs, cursor = cursor, update_existing = update_existing)
+                else:
+                    LOADERS[table](gbfs, cursor = cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+        task_seconds[table] = time.perf_counter() - start
+        print(f"...Loaded into '{table}' ({task_seconds[table]:.2f}s)")
+
+    try:
+        with ThreadPoolExecutor(max_workers = len(ordered_tables)) as executor:
+            futures = {}
+            for table in ordered_tables:
+                futures[table] = executor.submit(run_task, table, futures)
+
+            for table in ordered_tables:
+                futures[table].result()
+
+        conn = pool.getconn()
+        start = time.perf_counter()
+
+        try:
+            with conn.cursor() as cursor:
+                for table in ordered_tables:
+                    if table in snapshot_rows:
+                        LOADERS[table](gbfs, cursor = cursor, rows = snapshot_rows[table])
+                if update_existing:
+                    load_gbfs_feed_fingerprints_to_db(gbfs, cursor = cursor, fingerprints = fingerprints)
+                load_gbfs_snapshot_loaded_to_db(gbfs, cursor = cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+        task_seconds['snapshot'] = time.perf_counter() - start
+        print(f"...Snapshot rows committed ({task_seconds['snapshot']:.2f}s)")
+
+    except Exception:
+        # Keys of the rolled back inserts are not valid anymore
+        surrogate_keys.clear()
+        raise
+
+    return task_seconds
+
+
+def load_gbfs_to_db(gbfs_file_timestamp: int, gbfs: GBFSCollector = None):
+    """Ingest gbfs data to all tables of the database
+    Params:
+        gbfs_file_timestamp (int): The timestamp that identifies the GBFS json file to load into database
+        gbfs (GBFSCollector): A GBFSCollector instance with the snapshot already loaded (optional)
 
-        print("...Loading into 'stations_live'")
-        load_gbfs_stations_live_to_db(gbfs)
+    Returns:
+        report (dict): The timestamp, the total loading time, the loading time of each table
+            and the tables skipped because their feeds did not change, or None if nothing was loaded
+    """
 
-        print("...Loading into 'stations_details'")
-        load_gbfs_stations_details_to_db(gbfs)
+    if gbfs is None:
+        gbfs = GBFSCollector(load_latest_gbfs = False)
+        gbfs.load_json(timestamp = gbfs_file_timestamp)
 
-        print("...Loading into 'vehicle_types'")
-        load_gbfs_vehicle_types_to_db(gbfs)
+    query = """
+        SELECT COUNT(*) FILTER (WHERE timestamp = %s), MAX(timestamp)
+        FROM timestamps
+        WHERE is_loaded
+    """
+    results = request_db(query, [int(gbfs_file_timestamp)])
 
-        print("...Loading into 'bikes'")
-        load_gbfs_bikes_to_db(gbfs)
+    if results is None:
+        print('❌ The table \'timestamps\' could not be read. No operation was performed.')
+        return None
 
-        print("...Loading into 'bikes_live'")
-        load_gbfs_bikes_live_to_db(gbfs)
+    nb_timestamps, latest_timestamp = results['data'][0]
 
-        print("...Loading into 'bikes_details'")
-        load_gbfs_bikes_details_to_db(gbfs)
+    if nb_timestamps > 0:
+        print('❌​ This timestamp is already in the database. No operation was performed.')
+        return None
+
+    # A snapshot older than the last loaded one (e.g. retried after a failed load)
+    # must not bring the state of the stations and bikes back
+    update_existing = latest_timestamp is None or int(gbfs_file_timestamp) > latest_timestamp
+
+    start = time.perf_counter()
+
+    try:
+        # Skip the loaders whose feeds are the same as in the last loaded snapshot
+        fingerprints = gbfs.get_feed_fingerprints()
+        last_fingerprints = get_last_feed_fingerprints()
+        unchanged_feeds = [
+            feed for feed, fingerprint in fingerprints.items()
+            if last_fingerprints.get(feed) == fingerprint
+            ]
+        skipped_tables = [
+            table for table, feeds in LOADER_FEEDS.items()
+            if all(feed in unchanged_feeds for feed in feeds)
+            ]
+
+        task_seconds = run_load_tasks(
+            gbfs, skipped_tables = skipped_tables, update_existing = update_existing, fingerprints = fingerprints)
+
+    except Exception as e:
+        print(f"❌ Erreur : {e}")
+        print('❌ The snapshot could not be loaded. It is not marked as loaded and will be loaded again.')
+        return None
+
+    report = {
+        'timestamp': int(gbfs_file_timestamp),
+        'seconds': time.perf_counter() - start,
+        'task_seconds': task_seconds,
+        'skipped_tables': skipped_tables
+    }
+    print(f"✅ Snapshot loaded in {report['seconds']:.2f}s")
+
+    return report
 
 
 def load_multiple_gbfs_to_db(gbfs_file_timestamp_start: int = None, gbfs_file_timestamp_end: int = None):
@@ -484,24 +1044,163 @@ def load_multiple_gbfs_to_db(gbfs_file_timestamp_start: int = None, gbfs_file_ti
     Params:
         gbfs_file_timestamp_start (int): The timestamp of the first file to load into the database
         gbfs_file_timestamp_end (int): The timestamp of the last file to load into the database
+
+    Returns:
+        load_report (dict): The number of loaded snapshots, the total loading time
+            and the number of times each table was skipped
     """
 
-    gbfs_path = os.path.join(DATA_PATH, 'gbfs_json')
-    gbfs_files_list = [el for el in os.listdir(gbfs_path) if el.endswith('.json')]
-    gbfs_files_timestamps = [int(file.split("_")[-1].split(".")[0]) for file in gbfs_files_list]
+    load_report = {
+        'loaded': 0,
+        'not_loaded': 0,
+        'seconds': 0.0,
+        'skipped_tables': {table: 0 for table in LOADER_FEEDS}
+    }
 
-    if gbfs_file_timestamp_start is None:
-        gbfs_file_timestamp_start = min(tuple(gbfs_files_timestamps))
+    # Files are read and decoded ahead on background threads while the previous snapshot is loaded
+    for ts, gbfs in iter_snapshots(gbfs_file_timestamp_start, gbfs_file_timestamp_end):
+        print(f"... Loading gbfs_data_{ts}.json ...")
+        report = load_gbfs_to_db(ts, gbfs = gbfs)
+        print('---------------------' + '\n')
 
-    if gbfs_file_timestamp_end is None:
-        gbfs_file_timestamp_end = max(tuple(gbfs_files_timestamps))
+        if report is None:
+            load_report['not_loaded'] += 1
+            continue
 
-    timestamps_to_load = [ts for ts in gbfs_files_timestamps if (ts >= gbfs_file_timestamp_start and ts <= gbfs_file_timestamp_end)]
+        load_report['loaded'] += 1
+        load_report['seconds'] += report['seconds']
+        for table in report['skipped_tables']:
+            load_report['skipped_tables'][table] += 1
+
+    skipped = ', '.join(f'{table}={count}' for table, count in load_report['skipped_tables'].items())
+    print(f"""
+          📊 Load report
+          ✅ Loaded snapshots: {load_report['loaded']} ({load_report['seconds']:.1f}s)
+          ❌ Snapshots not loaded: {load_report['not_loaded']}
+          ⏭️ Skipped loaders (unchanged feeds): {skipped}
+          """)
+
+    return load_report
 
-    for ts in sorted(timestamps_to_load):
-        print(f"... Loading gbfs_data_{ts}.json ...")
-        load_gbfs_to_db(ts)
-        print('---------------------' + '\n')
+
+@with_db_connection
+def rebuild_density_tiles(cursor, start: int = None, end: int = None):
+    """Compute again the density tiles of the snapshots already in the database,
+    by whole time buckets (e.g. for snapshots loaded before the tiles existed).
+    The tiles are deleted and written again in a single transaction, rolled back on the first error.
+    Live loads wait for the end of the rebuild to write their tiles.
+    Params:
+        start (int): Timestamp of the first snapshot to aggregate
+        end (int): Timestamp of the last snapshot to aggregate
+    """
+
+    # Blocks the loads writing tiles until the end of the transaction, and waits for the loads
+    # whose tiles are not committed yet (their snapshots are then seen as loaded below)
+    cursor.execute("LOCK TABLE density_tiles, density_buckets IN SHARE ROW EXCLUSIVE MODE")
+
+    conditions = ['is_loaded']
+    placeholders = []
+
+    if start is not None:
+        conditions.append('timestamp >= %s')
+        placeholders.append(get_bucket(start))
+
+    if end is not None:
+        conditions.append('timestamp < %s')
+        placeholders.append(get_bucket(end) + TILE_BUCKET_SECONDS)
+
+    query = f"SELECT timestamp FROM timestamps WHERE {' AND '.join(conditions)}"
+    loaded_timestamps = set(row[0] for row in request_db(query, placeholders, cursor = cursor)['data'])
+
+    if not loaded_timestamps:
+        print('❌ There is no snapshot to aggregate in the database.')
+        return
+
+    bucket_start = get_bucket(min(loaded_timestamps))
+    bucket_end = get_bucket(max(loaded_timestamps))
+    delete_density_tiles(bucket_start, bucket_end, cursor = cursor)
+
+    for ts, gbfs in iter_snapshots(bucket_start, bucket_end + TILE_BUCKET_SECONDS - 1, feeds = DENSITY_FEEDS):
+        if ts in loaded_timestamps:
+            print(f"... Aggregating gbfs_data_{ts}.json ...")
+            load_gbfs_density_tiles_to_db(gbfs, cursor = cursor)
+            loaded_timestamps.remove(ts)
+
+    if loaded_timestamps:
+        print(f"⚠️ No JSON file for {len(loaded_timestamps)} loaded snapshots: they are not aggregated")
+
+
+def get_density_tiles(bbox: tuple = None, start: int = None, end: int = None, by_bucket: bool = False) -> pd.DataFrame:
+    """Query the density tiles, for map rendering
+    Params:
+        bbox (tuple): (min_lon, min_lat, max_lon, max_lat) of the area (everywhere if None)
+        start (int): Timestamp of the start of the time range (by whole time buckets)
+        end (int): Timestamp of the end of the time range (by whole time buckets)
+        by_bucket (bool): If True, one row per cell and time bucket, else one row per cell
+
+    Returns:
+        DataFrame with the cells ('cell_x', 'cell_y', 'bucket' if by_bucket, 'lat' and 'lon' of their center),
+        the mean numbers of free bikes, disabled bikes and station bikes per snapshot,
+        and the station occupancy (station bikes / station capacity)
+    """
+
+    buckets_conditions = ['TRUE']
+    buckets_placeholders = []
+
+    if start is not None:
+        buckets_conditions.append('bucket >= %s')
+        buckets_placeholders.append(get_bucket(start))
+
+    if end is not None:
+        buckets_conditions.append('bucket <= %s')
+        buckets_placeholders.append(get_bucket(end))
+
+    tiles_conditions = list(buckets_conditions)
+    tiles_placeholders = list(buckets_placeholders)
+
+    if bbox is not None:
+        min_cell_x, min_cell_y = get_cells(bbox[1], bbox[0])
+        max_cell_x, max_cell_y = get_cells(bbox[3], bbox[2])
+        tiles_conditions.append('cell_x BETWEEN %s AND %s AND cell_y BETWEEN %s AND %s')
+        tiles_placeholders.extend([int(min_cell_x), int(max_cell_x), int(min_cell_y), int(max_cell_y)])
+
+    group_columns = 'bucket, cell_x, cell_y' if by_bucket else 'cell_x, cell_y'
+
+    query = f"""
+        SELECT {group_columns},
+            SUM(free_bikes) AS free_bikes,
+            SUM(disabled_bikes) AS disabled_bikes,
+            SUM(station_bikes) AS station_bikes,
+            SUM(station_capacity) AS station_capacity
+        FROM density_tiles
+        WHERE {' AND '.join(tiles_conditions)}
+        GROUP BY {group_columns}
+    """
+    results = request_db(query, tiles_placeholders)
+    tiles_df = pd.DataFrame(data = results['data'], columns = results['columns'])
+
+    # Number of snapshots aggregated in each time bucket, to turn the sums into means per snapshot
+    query = f"""
+        SELECT bucket, nb_snapshots
+        FROM density_buckets
+        WHERE {' AND '.join(buckets_conditions)}
+    """
+    results = request_db(query, buckets_placeholders)
+    snapshots_df = pd.DataFrame(data = results['data'], columns = results['columns'])
+
+    if by_bucket:
+        tiles_df = tiles_df.merge(snapshots_df, on = 'bucket', how = 'inner')
+    else:
+        tiles_df['nb_snapshots'] = snapshots_df['nb_snapshots'].sum()
+
+    tiles_df['station_occupancy'] = tiles_df['station_bikes'] \
+        / tiles_df['station_capacity'].where(tiles_df['station_capacity'] > 0)
+
+    for column in ['free_bikes', 'disabled_bikes', 'station_bikes']:
+        tiles_df[column] = tiles_df[column] / tiles_df['nb_snapshots']
+    tiles_df['lat'], tiles_df['lon'] = get_cell_centers(tiles_df['cell_x'], tiles_df['cell_y'])
+
+    return tiles_df.drop(columns = ['station_capacity', 'nb_snapshots'])
 
 
 if __name__ == "__main__":
@@ -511,16 +1210,25 @@ if __name__ == "__main__":
     if command == 'create_database':
         create_db()
 
+    elif command == 'migrate_database':
+        create_db(sql_schema = sys.argv[2])
+
     elif command == 'load_files':
 
         gbfs_file_timestamp_start = None
         gbfs_file_timestamp_end = None
 
-        if len(sys.argv) == 3:
-            if sys.argv[2] == '-latest' or sys.argv[2] == '-l':
-                latest_timestamp = request_db('SELECT MAX(timestamp) FROM timestamps')['data'][0][0]
-                if latest_timestamp:
-                    gbfs_file_timestamp_start = latest_timestamp + 1
+        if len(sys.argv) == 3 and sys.argv[2] in ('-latest', '-l'):
+            # Start from the oldest snapshot whose load failed, if any, to load it again
+            query = """
+                SELECT MIN(timestamp) FILTER (WHERE NOT is_loaded), MAX(timestamp) FILTER (WHERE is_loaded)
+                FROM timestamps
+            """
+            oldest_not_loaded, latest_loaded = request_db(query)['data'][0]
+            if oldest_not_loaded:
+                gbfs_file_timestamp_start = oldest_not_loaded
+            elif latest_loaded:
+                gbfs_file_timestamp_start = latest_loaded + 1
 
         elif len(sys.argv) == 3:
             gbfs_file_timestamp_start = int(sys.argv[2])
@@ -530,3 +1238,8 @@ if __name__ == "__main__":
             gbfs_file_timestamp_end = int(sys.argv[3])
 
         load_multiple_gbfs_to_db(gbfs_file_timestamp_start, gbfs_file_timestamp_end)
+
+    elif command == 'build_tiles':
+        start = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+        end = int(sys.argv[3]) if len(sys.argv) >= 4 else None
+        rebuild_density_tiles(start, end)
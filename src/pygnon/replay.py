@@ -0,0 +1,455 @@
+from bisect import bisect_left, bisect_right
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from pygnon.config import DATA_PATH, DATABASE_CONFIG, REPLAY_DATABASE_CONFIG
+from pygnon.client import GBFSCollector, get_gbfs_json_path, list_gbfs_timestamps, read_gbfs_json
+from pygnon.database import load_gbfs_to_db, set_database_config
+
+
+class FakeGBFSServer:
+    """Local HTTP server replaying recorded GBFS snapshots with the GBFS 2.2 layout
+    expected by GBFSCollector.get_data_feeds"""
+
+
+    def __init__(
+        self,
+        snapshot_dir: str = None,
+        speed: float = 1.0,
+        latency_seconds: float = 0.0,
+        error_rate: float = 0.0,
+        rebase_timestamps: bool = True,
+        host: str = '127.0.0.1',
+        port: int = 0
+        ):
+        """
+        Params:
+            snapshot_dir (str): Directory of the recorded gbfs_data_<timestamp>.json files
+            speed (float): Replay speed multiplier (2.0 replays 2 recorded minutes per minute)
+            latency_seconds (float): Latency injected before answering each request
+            error_rate (float): Probability for each request to be answered with a 503
+            rebase_timestamps (bool): If True, shift the served 'last_updated' values
+                to the start of the replay, so that replayed snapshots are new to the database
+            host (str): Host the server listens on
+            port (int): Port the server listens on (0 picks a free port)
+        """
+
+        self.snapshot_dir = snapshot_dir or os.path.join(DATA_PATH, 'gbfs_json')
+        self.speed = speed
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.rebase_timestamps = rebase_timestamps
+
+        self.timestamps = list_gbfs_timestamps(gbfs_dir = self.snapshot_dir)
+
+        if not self.timestamps:
+            raise Exception(f"No GBFS snapshot to replay in {self.snapshot_dir}")
+
+        self.requests_count = 0
+        self.errors_count = 0
+        self.start_time = None
+        self.timestamp_offset = 0
+
+        self._lock = threading.Lock()
+        self._current_timestamp = None
+        self._current_data = None
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+    @property
+    def recorded_interval_seconds(self) -> float:
+        """Median interval between two recorded snapshots"""
+        if len(self.timestamps) < 2:
+            return 60.0
+        return float(np.median(np.diff(self.timestamps)))
+
+
+    @property
+    def is_exhausted(self) -> bool:
+        """True once the last recorded snapshot has been served for a full interval"""
+        return self.replay_timestamp() > self.timestamps[-1] + self.recorded_interval_seconds
+
+
+    def start(self):
+        self.start_time = time.time()
+        if self.rebase_timestamps:
+            self.timestamp_offset = int(self.start_time) - self.timestamps[0]
+        self._thread = threading.Thread(target = self._httpd.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+    def replay_timestamp(self, now: float = None) -> float:
+        """Returns the recorded time reached by the replay clock"""
+        now = time.time() if now is None else now
+        return self.timestamps[0] + (now - self.start_time) * self.speed
+
+
+    def published_at(self, served_timestamp: int) -> float:
+        """Returns the wall-clock time at which a served snapshot became available"""
+        recorded_timestamp = served_timestamp - self.timestamp_offset
+        return self.start_time + (recorded_timestamp - self.timestamps[0]) / self.speed
+
+
+    def snapshot_index(self, served_timestamp: int) -> int:
+        """Returns the index of a served snapshot among the recorded snapshots"""
+        return bisect_left(self.timestamps, served_timestamp - self.timestamp_offset)
+
+
+    def published_count(self) -> int:
+        """Returns the number of snapshots published since the start of the replay"""
+        return min(bisect_right(self.timestamps, self.replay_timestamp()), len(self.timestamps))
+
+
+    def current_snapshot(self) -> dict:
+        """Returns the snapshot currently served (read from disk once per snapshot)"""
+        index = max(self.published_count() - 1, 0)
+        timestamp = self.timestamps[index]
+
+        with self._lock:
+            if timestamp != self._current_timestamp:
+                filepath = get_gbfs_json_path(timestamp, self.snapshot_dir)
+                self._current_data = read_gbfs_json(filepath)
+                self._current_timestamp = timestamp
+            return self._current_data
+
+
+    def render_feed(self, feed_name: str):
+        """Returns the payload of a feed as served, or None if the feed is unknown"""
+        snapshot = self.current_snapshot()
+
+        if feed_name == 'gbfs':
+            # The recorded gbfs.json lists itself as a feed: keep every recorded feed
+            feed_names = list(snapshot)
+            payload = dict(snapshot.get('gbfs', {}))
+            payload.setdefault('version', '2.2')
+            payload['data'] = {'en': {'feeds': [
+                {'name': name, 'url': f'{self.base_url}/{name}.json'} for name in feed_names
+                ]}}
+
+        elif feed_name in snapshot:
+            payload = dict(snapshot[feed_name])
+
+        else:
+            return None
+
+        if 'last_updated' in payload:
+            payload['last_updated'] = payload['last_updated'] + self.timestamp_offset
+
+        return payload
+
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests_count += 1
+
+                if server.latency_seconds:
+                    time.sleep(server.latency_seconds)
+
+                if random.random() < server.error_rate:
+                    with server._lock:
+                        server.errors_count += 1
+                    self.send_error(503)
+                    return
+
+                feed_name = self.path.strip('/').split('?')[0]
+                feed_name = feed_name[:-len('.json')] if feed_name.endswith('.json') else feed_name
+                payload = server.render_feed(feed_name)
+
+                if payload is None:
+                    self.send_error(404)
+                    return
+
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def is_complete_snapshot(gbfs_data: dict) -> bool:
+    """Checks that every feed of a collected snapshot was retrieved"""
+    return bool(gbfs_data) and all(gbfs_data.values())
+
+
+def run_replay(
+    speed: float = 1.0,
+    duration_seconds: float = None,
+    latency_seconds: float = 0.0,
+    error_rate: float = 0.0,
+    load: bool = True,
+    snapshot_dir: str = None,
+    database_config: dict = REPLAY_DATABASE_CONFIG,
+    polls_per_interval: int = 10
+    ) -> dict:
+    """Replay recorded snapshots through GBFSCollector and the database loader.
+    Collected snapshots are saved in a temporary directory and loaded into
+    the replay database, never into DATA_PATH or the DATABASE_CONFIG database.
+
+    Params:
+        speed (float): Replay speed multiplier
+        duration_seconds (float): Maximum wall-clock length of the run
+            (None runs until the last recorded snapshot)
+        latency_seconds (float): Latency injected by the server on each request
+        error_rate (float): Rate of requests answered with an error by the server
+        load (bool): If False, only collect and save the snapshots
+        snapshot_dir (str): Directory of the recorded snapshots
+        database_config (dict): The database to load the snapshots into (REPLAY_DATABASE_CONFIG by default)
+        polls_per_interval (int): Number of polls of the server per recorded interval
+            (the snapshots already collected are ignored)
+
+    Returns:
+        report (dict): Throughput, latency percentiles and per-stage timings
+    """
+
+    if load:
+        if not database_config.get('database'):
+            raise Exception("No replay database: set REPLAY_DATABASE_NAME or pass database_config")
+
+        connection_keys = ['database', 'host', 'port']
+        if [database_config.get(key) for key in connection_keys] == [DATABASE_CONFIG.get(key) for key in connection_keys]:
+            raise Exception("The replay database must not be the database of DATABASE_CONFIG")
+
+    server = None
+    save_dir = tempfile.TemporaryDirectory()
+
+    stages = {'fetch': [], 'save': [], 'load': []}
+    table_times = {}
+    table_skips = {}
+    latencies = []
+    busy_seconds = 0.0
+    failed_collections = 0
+    failed_polls = 0
+    lost_to_errors = 0
+    missed_count = 0
+    failed_loads = 0
+    last_index = -1
+    processed_count = 0
+    last_processed_at = None
+
+    def count_unseen(index: int):
+        """Count the snapshots published before index and never collected: lost to the injected
+        errors if a poll failed since the last collection, else missed because the pipeline was busy"""
+        nonlocal lost_to_errors, missed_count
+        unseen = max(index - last_index - 1, 0)
+        if failed_polls:
+            lost_to_errors += unseen
+        else:
+            missed_count += unseen
+
+    try:
+        if load:
+            set_database_config(database_config)
+
+        server = FakeGBFSServer(
+            snapshot_dir = snapshot_dir,
+            speed = speed,
+            latency_seconds = latency_seconds,
+            error_rate = error_rate
+            ).start()
+
+        gbfs = GBFSCollector(load_latest_gbfs = False)
+        gbfs.base_url = server.base_url
+        poll_interval = server.recorded_interval_seconds / speed / polls_per_interval
+
+        while not server.is_exhausted:
+
+            if duration_seconds and time.time() - server.start_time >= duration_seconds:
+                break
+
+            poll_start = time.perf_counter()
+            gbfs.gbfs_data = gbfs.get_gbfs_data()
+            fetch_seconds = time.perf_counter() - poll_start
+
+            if not is_complete_snapshot(gbfs.gbfs_data):
+                # Retried at the next poll
+                failed_collections += 1
+                failed_polls += 1
+
+            elif server.snapshot_index(gbfs.gbfs_data['gbfs']['last_updated']) > last_index:
+                timestamp = gbfs.gbfs_data['gbfs']['last_updated']
+                index = server.snapshot_index(timestamp)
+                count_unseen(index)
+                last_index = index
+                failed_polls = 0
+                stages['fetch'].append(fetch_seconds)
+
+                stage_start = time.perf_counter()
+                gbfs.save_to_json(save_dir = save_dir.name)
+                stages['save'].append(time.perf_counter() - stage_start)
+
+                load_report = None
+                if load:
+                    stage_start = time.perf_counter()
+                    load_report = load_gbfs_to_db(timestamp, gbfs = gbfs)
+                    stages['load'].append(time.perf_counter() - stage_start)
+
+                if load and load_report is None:
+                    failed_loads += 1
+
+                else:
+                    for table, seconds in (load_report or {}).get('task_seconds', {}).items():
+                        table_times.setdefault(table, []).append(seconds)
+
+                    for table in (load_report or {}).get('skipped_tables', []):
+                        table_skips[table] = table_skips.get(table, 0) + 1
+
+                    last_processed_at = time.time()
+                    latencies.append(last_processed_at - server.published_at(timestamp))
+                    processed_count += 1
+
+                # Only the processing of new snapshots is pipeline work (not polls or injected errors)
+                busy_seconds += time.perf_counter() - poll_start
+
+            time.sleep(max(0.0, poll_interval - (time.perf_counter() - poll_start)))
+
+        wall_seconds = time.time() - server.start_time
+        published_count = server.published_count()
+        count_unseen(published_count)
+
+    finally:
+        if server is not None:
+            server.stop()
+        save_dir.cleanup()
+        if load:
+            set_database_config(DATABASE_CONFIG)
+
+    # Throughput over the span from the first publication to the last processed snapshot
+    # (not the wait for the end of the replay)
+    span_seconds = last_processed_at - server.start_time if last_processed_at else wall_seconds
+    stage_means = {stage: float(np.mean(times)) for stage, times in stages.items() if times}
+    utilisation = busy_seconds / span_seconds if span_seconds else 0.0
+
+    report = {
+        'speed': speed,
+        'wall_seconds': wall_seconds,
+        'offered_per_minute': 60 * speed / server.recorded_interval_seconds,
+        'published': published_count,
+        'processed': processed_count,
+        'missed': missed_count,
+        'failed_collections': failed_collections,
+        'lost_to_errors': lost_to_errors,
+        'failed_loads': failed_loads,
+        'server_errors': server.errors_count,
+        'snapshots_per_minute': 60 * (processed_count - 1) / span_seconds if processed_count > 1 and span_seconds else 0.0,
+        'latency_percentiles': {
+            f'p{q}': float(np.percentile(latencies, q)) for q in (50, 90, 99)
+            } if latencies else {},
+        'stage_mean_seconds': stage_means,
+        'table_mean_seconds': {table: float(np.mean(times)) for table, times in table_times.items()},
+        'table_skips': table_skips,
+        'utilisation': utilisation,
+        'bottleneck': max(stage_means, key = stage_means.get) if stage_means else None,
+        'saturated': utilisation >= 0.95 or missed_count > 1
+    }
+
+    return report
+
+
+def print_replay_report(report: dict):
+    """Print a replay report"""
+
+    latencies = ', '.join(
+        f'{name}={seconds:.2f}s' for name, seconds in report['latency_percentiles'].items()
+        )
+    stages = ', '.join(
+        f'{stage}={seconds:.2f}s' for stage, seconds in report['stage_mean_seconds'].items()
+        )
+
+    tables = ', '.join(
+        f'{table}={seconds:.2f}s' for table, seconds in report['table_mean_seconds'].items()
+        )
+
+    skips = ', '.join(f'{table}={count}' for table, count in report['table_skips'].items())
+
+    print(f"""
+          🚲 ... Replay at x{report['speed']} ...
+          ⏱️ Wall time: {report['wall_seconds']:.1f}s
+          📥 Offered: {report['offered_per_minute']:.1f} snapshots/min
+          📤 Sustained: {report['snapshots_per_minute']:.1f} snapshots/min
+          🗂️ Published / processed / missed: {report['published']} / {report['processed']} / {report['missed']}
+          ❌ Failed collections: {report['failed_collections']} (server errors: {report['server_errors']}, snapshots lost: {report['lost_to_errors']})
+          ❌ Failed loads: {report['failed_loads']}
+          ⌛ End-to-end latency: {latencies}
+          🔎 Mean time per stage: {stages}
+          🗃️ Mean loading time per table: {tables}
+          ⏭️ Skipped loaders (unchanged feeds): {skips}
+          ⚙️ Utilisation: {report['utilisation']:.0%} - bottleneck: {report['bottleneck']}
+          {'🔥 Saturated' if report['saturated'] else '✅ Keeping up'}
+          """)
+
+
+def find_saturation(speeds: tuple = (1, 2, 5, 10, 20, 50), duration_seconds: float = 60, **kwargs) -> list:
+    """Replay at increasing speeds until the pipeline stops keeping up
+    Params:
+        speeds (tuple): Replay speed multipliers to try, in increasing order
+        duration_seconds (float): Wall-clock length of each run
+        **kwargs: Other arguments passed to run_replay
+
+    Returns:
+        reports (list): The reports of the runs, the last one being the saturated run if any
+    """
+
+    reports = []
+
+    for speed in speeds:
+        report = run_replay(speed = speed, duration_seconds = duration_seconds, **kwargs)
+        print_replay_report(report)
+        reports.append(report)
+
+        if report['saturated']:
+            print(f"🔥 The pipeline saturates at x{speed} "
+                  f"({report['offered_per_minute']:.1f} snapshots/min offered, "
+                  f"{report['snapshots_per_minute']:.1f} sustained), "
+                  f"bottleneck: {report['bottleneck']}")
+            break
+
+    else:
+        print("✅ The pipeline kept up at every speed")
+
+    return reports
+
+
+if __name__ == "__main__":
+
+    command = sys.argv[1]
+
+    if command == 'run':
+        speed = float(sys.argv[2]) if len(sys.argv) >= 3 else 1.0
+        duration_seconds = float(sys.argv[3]) if len(sys.argv) >= 4 else None
+        print_replay_report(run_replay(speed = speed, duration_seconds = duration_seconds))
+
+    elif command == 'saturation':
+        duration_seconds = float(sys.argv[2]) if len(sys.argv) >= 3 else 60
+        find_saturation(duration_seconds = duration_seconds)
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from pygnon.config import TILE_BUCKET_SECONDS, TILE_CELL_DEGREES
+from pygnon.client import GBFSCollector
+
+
+# Feeds needed to compute the density tiles of a snapshot
+DENSITY_FEEDS = ['free_bike_status', 'station_status', 'station_information']
+
+# Counts summed over the snapshots of a time bucket
+DENSITY_COLUMNS = ['free_bikes', 'disabled_bikes', 'station_bikes', 'station_capacity']
+
+
+def get_bucket(timestamp: int, bucket_seconds: int = TILE_BUCKET_SECONDS) -> int:
+    """Returns the start of the time bucket of a timestamp"""
+    return int(timestamp) - int(timestamp) % bucket_seconds
+
+
+def get_cells(lat, lon, cell_degrees: float = TILE_CELL_DEGREES) -> tuple:
+    """Returns the (cell_x, cell_y) grid coordinates of positions
+    Params:
+        lat: Latitudes (array-like)
+        lon: Longitudes (array-like)
+        cell_degrees (float): Size of a cell, in degrees
+
+    Returns:
+        (cell_x, cell_y): Two arrays of integers
+    """
+    cell_x = np.floor(np.asarray(lon, dtype = float) / cell_degrees).astype(int)
+    cell_y = np.floor(np.asarray(lat, dtype = float) / cell_degrees).astype(int)
+    return cell_x, cell_y
+
+
+def get_cell_centers(cell_x, cell_y, cell_degrees: float = TILE_CELL_DEGREES) -> tuple:
+    """Returns the (lat, lon) of the centers of grid cells"""
+    lat = (np.asarray(cell_y) + 0.5) * cell_degrees
+    lon = (np.asarray(cell_x) + 0.5) * cell_degrees
+    return lat, lon
+
+
+def compute_density_tiles(gbfs: GBFSCollector) -> pd.DataFrame:
+    """Aggregate a snapshot on the grid
+    Params:
+        gbfs (GBFSCollector): A GBFSCollector instance
+
+    Returns:
+        DataFrame with the columns 'bucket', 'cell_x', 'cell_y' and DENSITY_COLUMNS,
+        one row per non-empty cell
+    """
+
+    cells = []
+
+    bikes_df = gbfs.get_free_bikes_status_df()
+    if not bikes_df.empty:
+        cell_x, cell_y = get_cells(bikes_df['lat'], bikes_df['lon'])
+        is_disabled = bikes_df['is_disabled'].astype(bool)
+        is_free = (bikes_df['station_id'] == 'no_station') & ~is_disabled & ~bikes_df['is_reserved'].astype(bool)
+        cells.append(pd.DataFrame({
+            'cell_x': cell_x,
+            'cell_y': cell_y,
+            'free_bikes': is_free.astype(int).values,
+            'disabled_bikes': is_disabled.astype(int).values
+            }))
+
+    stations_df = gbfs.get_station_information_df()[['station_id', 'lat', 'lon', 'capacity']].merge(
+        gbfs.get_station_status_df()[['station_id', 'num_bikes_available']],
+        on = 'station_id'
+        )
+    if not stations_df.empty:
+        cell_x, cell_y = get_cells(stations_df['lat'], stations_df['lon'])
+        cells.append(pd.DataFrame({
+            'cell_x': cell_x,
+            'cell_y': cell_y,
+            'station_bikes': stations_df['num_bikes_available'].values,
+            'station_capacity': stations_df['capacity'].values
+            }))
+
+    if not cells:
+        return pd.DataFrame(columns = ['bucket', 'cell_x', 'cell_y'] + DENSITY_COLUMNS)
+
+    tiles_df = pd.concat(cells).reindex(columns = ['cell_x', 'cell_y'] + DENSITY_COLUMNS).fillna(0)
+    tiles_df = tiles_df.groupby(['cell_x', 'cell_y'], as_index = False).sum()
+    tiles_df[DENSITY_COLUMNS] = tiles_df[DENSITY_COLUMNS].astype(int)
+    tiles_df.insert(0, 'bucket', get_bucket(gbfs.gbfs_data['gbfs']['last_updated']))
+
+    return tiles_df
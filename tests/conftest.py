@@ -0,0 +1,30 @@
+import pytest
+
+from pygnon.client import GBFSCollector
+
+
+@pytest.fixture
+def density_gbfs():
+    """A snapshot with the feeds of the density tiles"""
+    gbfs = GBFSCollector(load_latest_gbfs = False)
+    gbfs.gbfs_data = {
+        'gbfs': {'last_updated': 1759839816},
+        'free_bike_status': {'data': {'bikes': [
+            # Free bike and disabled bike in the same cell as the station '1'
+            {'bike_id': 'a', 'lat': 43.3001, 'lon': 5.4001, 'station_id': '', 'is_reserved': 0, 'is_disabled': 0},
+            {'bike_id': 'b', 'lat': 43.3002, 'lon': 5.4002, 'station_id': '', 'is_reserved': 0, 'is_disabled': 1},
+            # Reserved bike: neither free nor disabled
+            {'bike_id': 'c', 'lat': 43.3003, 'lon': 5.4003, 'station_id': '', 'is_reserved': 1, 'is_disabled': 0},
+            # Bike docked at the station '2': counted by the station
+            {'bike_id': 'd', 'lat': 43.4001, 'lon': 5.5001, 'station_id': '2', 'is_reserved': 0, 'is_disabled': 0}
+            ]}},
+        'station_information': {'data': {'stations': [
+            {'station_id': '1', 'lat': 43.3004, 'lon': 5.4004, 'capacity': 10},
+            {'station_id': '2', 'lat': 43.4002, 'lon': 5.5002, 'capacity': 20}
+            ]}},
+        'station_status': {'data': {'stations': [
+            {'station_id': '1', 'num_bikes_available': 3, 'vehicle_types_available': []},
+            {'station_id': '2', 'num_bikes_available': 1, 'vehicle_types_available': []}
+            ]}}
+    }
+    return gbfs
@@ -0,0 +1,161 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pygnon import client
+from pygnon.client import GBFSCollector, get_feed_fingerprint, get_gbfs_json_path, iter_snapshots, read_gbfs_json
+
+
+def station_information(last_updated: int, capacity: int = 20) -> dict:
+    return {
+        'last_updated': last_updated,
+        'ttl': 0,
+        'data': {'stations': [{'station_id': '1', 'lat': 43.3, 'lon': 5.4, 'capacity': capacity}]}
+    }
+
+
+def test_feed_fingerprint_ignores_last_updated():
+    assert get_feed_fingerprint(station_information(1759839816)) == get_feed_fingerprint(station_information(1759839876))
+
+
+def test_feed_fingerprint_ignores_key_order():
+    payload = station_information(1759839816)
+    reordered = dict(reversed(list(payload.items())))
+
+    assert get_feed_fingerprint(reordered) == get_feed_fingerprint(payload)
+
+
+def test_feed_fingerprint_changes_with_content():
+    assert get_feed_fingerprint(station_information(1759839816, capacity = 21)) != get_feed_fingerprint(station_information(1759839816))
+
+
+def test_get_feed_fingerprints_by_feed():
+    gbfs = GBFSCollector(load_latest_gbfs = False)
+    gbfs.gbfs_data = {
+        'gbfs': {'last_updated': 1759839816, 'data': {}},
+        'station_information': station_information(1759839816)
+    }
+
+    fingerprints = gbfs.get_feed_fingerprints()
+
+    assert set(fingerprints) == {'gbfs', 'station_information'}
+    assert all(len(fingerprint) == 64 for fingerprint in fingerprints.values())
+
+
+@pytest.fixture
+def gbfs_dir(tmp_path):
+    """Directory of recorded snapshots, written out of timestamp order"""
+    for timestamp in [1759839936, 1759839816, 1759839996, 1759839876, 1759840056]:
+        snapshot = {
+            'gbfs': {'last_updated': timestamp},
+            'station_information': station_information(timestamp),
+            'vehicle_types': {'last_updated': timestamp, 'data': {'vehicle_types': [{'vehicle_type_id': '1'}]}}
+        }
+        with open(get_gbfs_json_path(timestamp, str(tmp_path)), 'w') as file:
+            json.dump(snapshot, file)
+    return str(tmp_path)
+
+
+def test_iter_snapshots_yields_in_timestamp_order(monkeypatch, gbfs_dir):
+
+    def slow_read(filepath, feeds = None):
+        # Random reading times, so that reads complete out of order
+        time.sleep(random.uniform(0, 0.02))
+        return read_gbfs_json(filepath, feeds)
+
+    monkeypatch.setattr(client, 'read_gbfs_json', slow_read)
+
+    snapshots = list(iter_snapshots(1759839876, 1759839996, prefetch = 4, workers = 4, gbfs_dir = gbfs_dir))
+
+    assert [timestamp for timestamp, _ in snapshots] == [1759839876, 1759839936, 1759839996]
+    assert all(gbfs.gbfs_data['gbfs']['last_updated'] == timestamp for timestamp, gbfs in snapshots)
+
+
+def test_iter_snapshots_keeps_the_requested_feeds(gbfs_dir):
+    timestamp, gbfs = next(iter_snapshots(feeds = ['vehicle_types'], gbfs_dir = gbfs_dir))
+
+    assert timestamp == 1759839816
+    assert set(gbfs.gbfs_data) == {'gbfs', 'vehicle_types'}
+
+
+def test_iter_snapshots_yields_tables(gbfs_dir):
+    timestamp, tables = next(iter_snapshots(feeds = ['vehicle_types'], tables = True, gbfs_dir = gbfs_dir))
+
+    assert list(tables) == ['vehicle_types']
+    assert tables['vehicle_types']['vehicle_type_id'].tolist() == [1]
+
+
+def test_iter_snapshots_decodes_on_processes(gbfs_dir):
+    snapshots = list(iter_snapshots(feeds = ['vehicle_types'], tables = True, workers = 2, gbfs_dir = gbfs_dir, processes = True))
+
+    assert [timestamp for timestamp, _ in snapshots] == [1759839816, 1759839876, 1759839936, 1759839996, 1759840056]
+    assert all(tables['vehicle_types']['vehicle_type_id'].tolist() == [1] for _, tables in snapshots)
+
+
+def test_iter_snapshots_reads_ahead_within_the_window(monkeypatch, gbfs_dir):
+    read_files = []
+    reads = threading.Semaphore(0)
+
+    def counting_read(filepath, feeds = None):
+        read_files.append(filepath)
+        reads.release()
+        return read_gbfs_json(filepath, feeds)
+
+    monkeypatch.setattr(client, 'read_gbfs_json', counting_read)
+
+    snapshots = iter_snapshots(prefetch = 2, workers = 2, gbfs_dir = gbfs_dir)
+    next(snapshots)
+
+    # The consumer holds one snapshot: the next one is read ahead, but no more than 'prefetch' files.
+    # Reads are only submitted by the consumer, so once both are done no other read can start
+    assert reads.acquire(timeout = 5) and reads.acquire(timeout = 5)
+    assert len(read_files) == 2
+
+    next(snapshots)
+    assert reads.acquire(timeout = 5)
+    assert len(read_files) == 3
+
+
+def test_iter_snapshots_stops_reading_when_closed(monkeypatch, gbfs_dir):
+    read_files = []
+    futures = []
+    reading_second_file = threading.Event()
+    release_second_file = threading.Event()
+    second_file = get_gbfs_json_path(1759839876, gbfs_dir)
+
+    def blocking_read(filepath, feeds = None):
+        read_files.append(filepath)
+        if filepath == second_file:
+            reading_second_file.set()
+            release_second_file.wait(timeout = 5)
+        return read_gbfs_json(filepath, feeds)
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            futures.append(super().submit(*args, **kwargs))
+            return futures[-1]
+
+    monkeypatch.setattr(client, 'read_gbfs_json', blocking_read)
+    monkeypatch.setattr(client, 'ThreadPoolExecutor', RecordingExecutor)
+
+    # A single worker: the third file waits in the queue while the second one is read
+    snapshots = iter_snapshots(prefetch = 3, workers = 1, gbfs_dir = gbfs_dir)
+    next(snapshots)
+    assert reading_second_file.wait(timeout = 5)
+
+    # close() waits for the read in progress: run it aside, and release the read once the queue is cancelled
+    closing = threading.Thread(target = snapshots.close)
+    closing.start()
+    deadline = time.monotonic() + 5
+    while not futures[2].cancelled() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release_second_file.set()
+    closing.join(timeout = 5)
+
+    assert not closing.is_alive()
+    assert futures[2].cancelled()
+    assert read_files == [get_gbfs_json_path(1759839816, gbfs_dir), second_file]
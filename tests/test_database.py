@@ -0,0 +1,334 @@
+import pytest
+
+from pygnon import database
+from pygnon.client import GBFSCollector
+from pygnon.tiles import get_bucket
+
+
+class StubConnection:
+    """Records the transaction calls of a pooled connection"""
+
+    def __init__(self, events: list):
+        self.events = events
+        self.table = None
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def commit(self):
+        self.events.append(('commit', self.table))
+
+    def rollback(self):
+        self.events.append(('rollback', self.table))
+
+
+class StubPool:
+
+    def __init__(self, events: list):
+        self.events = events
+        self.nb_connections = 0
+
+    def getconn(self):
+        self.nb_connections += 1
+        return StubConnection(self.events)
+
+    def putconn(self, conn):
+        self.nb_connections -= 1
+
+
+@pytest.fixture
+def gbfs():
+    gbfs = GBFSCollector(load_latest_gbfs = False)
+    gbfs.gbfs_data = {'gbfs': {'last_updated': 1759839816}}
+    return gbfs
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+def stub_loaders(monkeypatch, events: list, failing_table: str = None):
+    """Replace the loaders and row getters with stubs recording their calls.
+    The connection of the snapshot transaction is named 'snapshot'"""
+
+    def make_loader(table):
+        def loader(gbfs, cursor = None, rows = None, update_existing = True, fingerprints = None):
+            is_snapshot_write = rows is not None or table not in database.LOAD_DEPENDENCIES
+            cursor.table = cursor.table or ('snapshot' if is_snapshot_write else table)
+            events.append(('snapshot_write' if cursor.table == 'snapshot' else 'write', table, update_existing))
+            if table == failing_table:
+                raise Exception(f"Loading '{table}' failed")
+        return loader
+
+    def make_row_getter(table):
+        def get_rows(gbfs, cursor = None):
+            cursor.table = table
+            if table == failing_table:
+                raise Exception(f"Loading '{table}' failed")
+            return [table]
+        return get_rows
+
+    for table in database.LOADERS:
+        monkeypatch.setitem(database.LOADERS, table, make_loader(table))
+    for table in database.SNAPSHOT_ROWS:
+        monkeypatch.setitem(database.SNAPSHOT_ROWS, table, make_row_getter(table))
+    monkeypatch.setattr(database, 'load_gbfs_feed_fingerprints_to_db', make_loader('feed_fingerprints'))
+    monkeypatch.setattr(database, 'load_gbfs_snapshot_loaded_to_db', make_loader('snapshot_loaded'))
+    monkeypatch.setattr(database, 'delete_feed_fingerprints', lambda feeds, cursor = None: None)
+
+
+def snapshot_writes(events: list) -> list:
+    """Tables written by the snapshot transaction, in order"""
+    return [event[1] for event in events if event[0] == 'snapshot_write']
+
+
+def use_pool(monkeypatch, pool: StubPool):
+    monkeypatch.setattr(database, '_connection_pool', pool)
+
+
+def test_sort_load_tasks_respects_foreign_keys():
+    ordered_tables = database.sort_load_tasks()
+
+    assert sorted(ordered_tables) == sorted(database.LOAD_DEPENDENCIES)
+    for table, dependencies in database.LOAD_DEPENDENCIES.items():
+        for dependency in dependencies:
+            assert ordered_tables.index(dependency) < ordered_tables.index(table)
+
+
+def test_sort_load_tasks_detects_cycles():
+    with pytest.raises(Exception, match = 'Circular'):
+        database.sort_load_tasks({'a': ['b'], 'b': ['a']})
+
+
+def test_run_load_tasks_writes_snapshot_rows_in_one_transaction(monkeypatch, gbfs, events):
+    pool = StubPool(events)
+    use_pool(monkeypatch, pool)
+    stub_loaders(monkeypatch, events)
+
+    task_seconds = database.run_load_tasks(gbfs)
+
+    assert set(task_seconds) == set(database.LOAD_DEPENDENCIES) | {'snapshot'}
+    committed = [event[1] for event in events if event[0] == 'commit']
+    assert set(committed) == set(database.LOAD_DEPENDENCIES) | {'snapshot'}
+
+    # The snapshot rows, the fingerprints and the 'is_loaded' flag are written by one transaction,
+    # after every task, and committed once
+    assert sorted(snapshot_writes(events)) == sorted(list(database.SNAPSHOT_ROWS) + ['feed_fingerprints', 'snapshot_loaded'])
+    first_write = min(events.index(event) for event in events if event[0] == 'snapshot_write')
+    assert all(events.index(('commit', table)) < first_write for table in database.LOAD_DEPENDENCIES)
+    assert events[-1] == ('commit', 'snapshot')
+    assert pool.nb_connections == 0
+
+
+def test_run_load_tasks_rolls_back_snapshot_when_a_write_fails(monkeypatch, gbfs, events):
+    pool = StubPool(events)
+    use_pool(monkeypatch, pool)
+    stub_loaders(monkeypatch, events, failing_table = 'snapshot_loaded')
+    database.surrogate_keys.register('bikes', [('bike_1', 1)])
+
+    with pytest.raises(Exception, match = "Loading 'snapshot_loaded' failed"):
+        database.run_load_tasks(gbfs)
+
+    assert ('rollback', 'snapshot') in events
+    assert ('commit', 'snapshot') not in events
+    assert database.surrogate_keys._keys['bikes'] == {}
+    assert pool.nb_connections == 0
+
+
+def test_run_load_tasks_does_not_write_snapshot_when_a_task_fails(monkeypatch, gbfs, events):
+    pool = StubPool(events)
+    use_pool(monkeypatch, pool)
+    stub_loaders(monkeypatch, events, failing_table = 'bikes')
+
+    with pytest.raises(Exception, match = "Loading 'bikes' failed"):
+        database.run_load_tasks(gbfs)
+
+    assert ('rollback', 'bikes') in events
+    assert not snapshot_writes(events)
+    assert pool.nb_connections == 0
+
+
+def test_run_load_tasks_skips_tables(monkeypatch, gbfs, events):
+    use_pool(monkeypatch, StubPool(events))
+    stub_loaders(monkeypatch, events)
+
+    task_seconds = database.run_load_tasks(gbfs, skipped_tables = ['stations', 'vehicle_types'])
+
+    assert 'stations' not in task_seconds
+    assert 'vehicle_types' not in task_seconds
+    assert 'stations_live' in task_seconds
+
+
+def test_run_load_tasks_deletes_fingerprints_with_the_loaders_of_their_feeds(monkeypatch, gbfs, events):
+    use_pool(monkeypatch, StubPool(events))
+    stub_loaders(monkeypatch, events)
+    deletes = []
+    written_fingerprints = []
+    monkeypatch.setattr(database, 'delete_feed_fingerprints', lambda feeds, cursor = None: deletes.append((cursor, feeds)))
+    monkeypatch.setattr(database, 'load_gbfs_feed_fingerprints_to_db', lambda gbfs, cursor = None, fingerprints = None: written_fingerprints.append(fingerprints))
+
+    database.run_load_tasks(gbfs, skipped_tables = ['vehicle_types'], fingerprints = {'vehicle_types': 'abc'})
+
+    # Each delete runs on the connection (in the transaction) of the loader of the feed
+    deleted = {cursor.table: feeds for cursor, feeds in deletes}
+    assert deleted == {table: feeds for table, feeds in database.LOADER_FEEDS.items() if table != 'vehicle_types'}
+    assert written_fingerprints == [{'vehicle_types': 'abc'}]
+
+
+def test_run_load_tasks_keeps_the_state_for_older_snapshots(monkeypatch, gbfs, events):
+    use_pool(monkeypatch, StubPool(events))
+    stub_loaders(monkeypatch, events)
+
+    database.run_load_tasks(gbfs, update_existing = False)
+
+    state_writes = [event for event in events if event[0] == 'write' and event[1] in database.STATE_TABLES]
+    assert len(state_writes) == len(database.STATE_TABLES)
+    assert not any(update_existing for _, _, update_existing in state_writes)
+    assert 'feed_fingerprints' not in snapshot_writes(events)
+    assert 'snapshot_loaded' in snapshot_writes(events)
+
+
+def test_load_gbfs_to_db_loads_older_snapshots_without_updating_the_state(monkeypatch, gbfs):
+    monkeypatch.setattr(database, 'request_db', lambda query, placeholders = None: (
+        {'columns': ['count', 'max'], 'data': [(0, 1759839876)]} if 'timestamps' in query else {'columns': ['feed', 'fingerprint'], 'data': []}
+        ))
+    calls = []
+    monkeypatch.setattr(database, 'run_load_tasks', lambda gbfs, **kwargs: calls.append(kwargs) or {})
+
+    assert database.load_gbfs_to_db(1759839816, gbfs = gbfs) is not None
+    assert calls[0]['update_existing'] is False
+
+
+def test_load_gbfs_to_db_reports_unreadable_fingerprints(monkeypatch, gbfs):
+    monkeypatch.setattr(database, 'request_db', lambda query, placeholders = None: (
+        {'columns': ['count', 'max'], 'data': [(0, None)]} if 'timestamps' in query else None
+        ))
+    monkeypatch.setattr(database, 'run_load_tasks', lambda *args, **kwargs: pytest.fail('Nothing should be loaded'))
+
+    assert database.load_gbfs_to_db(1759839816, gbfs = gbfs) is None
+
+
+def test_load_gbfs_to_db_reports_missing_snapshot(monkeypatch):
+    monkeypatch.setattr(database, 'request_db', lambda query, placeholders = None: (
+        {'columns': ['count', 'max'], 'data': [(0, None)]} if 'timestamps' in query else {'columns': ['feed', 'fingerprint'], 'data': []}
+        ))
+    monkeypatch.setattr(database, 'run_load_tasks', lambda *args, **kwargs: pytest.fail('Nothing should be loaded'))
+    empty_gbfs = GBFSCollector(load_latest_gbfs = False)
+
+    assert database.load_gbfs_to_db(1759839816, gbfs = empty_gbfs) is None
+
+
+def test_load_gbfs_to_db_reports_unreadable_timestamps(monkeypatch, gbfs):
+    monkeypatch.setattr(database, 'request_db', lambda query, placeholders = None: None)
+
+    assert database.load_gbfs_to_db(1759839816, gbfs = gbfs) is None
+
+
+def test_load_gbfs_density_tiles_counts_the_snapshot_in_its_bucket(monkeypatch, density_gbfs):
+    written = {}
+    monkeypatch.setattr(database, 'upsert_density_tiles', lambda rows, cursor = None: written.update(tiles = rows))
+    monkeypatch.setattr(database, 'upsert_density_buckets', lambda rows, cursor = None: written.update(buckets = rows))
+
+    database.load_gbfs_density_tiles_to_db(density_gbfs, cursor = object())
+
+    assert len(written['tiles']) == 2
+    assert written['buckets'] == [(get_bucket(1759839816), 1)]
+
+
+def test_load_gbfs_to_db_fingerprints_the_snapshot_once(monkeypatch, gbfs):
+    monkeypatch.setattr(database, 'request_db', lambda query, placeholders = None: (
+        {'columns': ['count', 'max'], 'data': [(0, None)]} if 'timestamps' in query else {'columns': ['feed', 'fingerprint'], 'data': []}
+        ))
+    calls = []
+    monkeypatch.setattr(database, 'run_load_tasks', lambda gbfs, **kwargs: calls.append(kwargs) or {})
+    nb_fingerprints = []
+    get_feed_fingerprints = gbfs.get_feed_fingerprints
+    monkeypatch.setattr(gbfs, 'get_feed_fingerprints', lambda: nb_fingerprints.append(1) or get_feed_fingerprints())
+
+    database.load_gbfs_to_db(1759839816, gbfs = gbfs)
+
+    assert len(nb_fingerprints) == 1
+    assert set(calls[0]['fingerprints']) == {'gbfs'}
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    """An empty key cache, with the tables 'stations' and 'bikes' stubbed.
+    The ids queried by the cache are recorded in keys.queried"""
+    keys = database.SurrogateKeyCache()
+    keys.tables = {'stations': {'no_station': 10, '1': 11, '2': 12}, 'bikes': {'a': 1, 'b': 2, 'c': 3, 'd': 4}}
+    keys.queried = []
+
+    def request_db(query, placeholders = None, cursor = None):
+        table_name = 'stations' if 'station_key' in repr(query) else 'bikes'
+        ids = placeholders[0]
+        keys.queried.append(sorted(ids))
+        table_keys = keys.tables[table_name]
+        return {'columns': ['id', 'key'], 'data': [(row_id, table_keys[row_id]) for row_id in ids if row_id in table_keys]}
+
+    monkeypatch.setattr(database, 'request_db', request_db)
+    monkeypatch.setattr(database, 'surrogate_keys', keys)
+    return keys
+
+
+def test_surrogate_keys_query_the_missing_ids_once(keys):
+    keys.register('stations', [('1', 11)])
+
+    assert keys.get_keys('stations', ['2', '1', '2', 'no_station']) == [12, 11, 12, 10]
+    assert keys.queried == [['2', 'no_station']]
+
+    assert keys.get_keys('stations', ['no_station', '2']) == [10, 12]
+    assert keys.queried == [['2', 'no_station']]
+
+
+def test_surrogate_keys_raise_on_unknown_ids(keys):
+    with pytest.raises(KeyError, match = 'unknown_station'):
+        keys.get_keys('stations', ['1', 'unknown_station'])
+
+    # The known ids are still cached
+    assert keys.get_keys('stations', ['1']) == [11]
+    assert len(keys.queried) == 1
+
+
+def test_stations_live_rows_use_station_keys(monkeypatch, keys, density_gbfs):
+    monkeypatch.setattr(database, 'get_table_columns', lambda table_name, cursor = None: ['station_key', 'timestamp', 'num_bikes_available'])
+
+    rows = database.get_gbfs_stations_live_rows(density_gbfs)
+
+    assert rows == [(11, 1759839816, 3), (12, 1759839816, 1)]
+
+
+def test_bikes_live_rows_use_bike_and_station_keys(monkeypatch, keys, density_gbfs):
+    monkeypatch.setattr(database, 'get_table_columns', lambda table_name, cursor = None: ['bike_key', 'station_key', 'timestamp'])
+
+    rows = database.get_gbfs_bikes_live_rows(density_gbfs)
+
+    # Bikes with no station are attached to the 'no_station' station
+    assert rows == [(1, 10, 1759839816), (2, 10, 1759839816), (3, 10, 1759839816), (4, 12, 1759839816)]
+
+
+def test_bikes_live_rows_reject_unknown_stations(monkeypatch, keys, density_gbfs):
+    monkeypatch.setattr(database, 'get_table_columns', lambda table_name, cursor = None: ['bike_key', 'station_key', 'timestamp'])
+    del keys.tables['stations']['2']
+
+    with pytest.raises(KeyError):
+        database.get_gbfs_bikes_live_rows(density_gbfs)
+
+
+def test_insert_into_db_ignores_conflicts_when_returning(monkeypatch):
+    queries = []
+    monkeypatch.setattr(database, 'get_table_columns', lambda table_name, cursor = None: ['id', 'is_active_station'])
+    monkeypatch.setattr(database, 'execute_values', lambda cursor, query, rows, fetch = False: queries.append(repr(query)) or [('1', 11)])
+
+    new_keys = database.insert_into_db(
+        'stations', [('1', True)], returning = ['id', 'station_key'], ignore_conflicts = True, cursor = object())
+
+    assert new_keys == [('1', 11)]
+    assert queries[0].index('ON CONFLICT DO NOTHING') < queries[0].index('RETURNING')
@@ -0,0 +1,120 @@
+import json
+import os
+
+import pytest
+import requests
+
+from pygnon import replay
+from pygnon.client import get_gbfs_json_path
+from pygnon.config import DATABASE_CONFIG
+from pygnon.replay import FakeGBFSServer, run_replay
+
+
+RECORDED_TIMESTAMPS = [1759839816, 1759839876, 1759839936, 1759839996, 1759840056]
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path):
+    """Directory of recorded snapshots, one per minute"""
+    for index, timestamp in enumerate(RECORDED_TIMESTAMPS):
+        snapshot = {
+            'gbfs': {'last_updated': timestamp, 'ttl': 0, 'data': {'en': {'feeds': []}}},
+            'station_status': {'last_updated': timestamp, 'data': {'stations': [{'station_id': '1', 'num_bikes_available': index}]}}
+        }
+        with open(get_gbfs_json_path(timestamp, str(tmp_path)), 'w') as file:
+            json.dump(snapshot, file)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def server(snapshot_dir):
+    server = FakeGBFSServer(snapshot_dir = snapshot_dir, speed = 60).start()
+    yield server
+    server.stop()
+
+
+def test_server_rewrites_the_feed_urls(server):
+    payload = server.render_feed('gbfs')
+
+    feeds = {feed['name']: feed['url'] for feed in payload['data']['en']['feeds']}
+    assert feeds == {name: f'{server.base_url}/{name}.json' for name in ['gbfs', 'station_status']}
+
+
+def test_server_rebases_timestamps(server):
+    payload = server.render_feed('station_status')
+
+    assert payload['last_updated'] == RECORDED_TIMESTAMPS[0] + server.timestamp_offset
+    assert abs(payload['last_updated'] - server.start_time) < 1
+    assert server.snapshot_index(payload['last_updated']) == 0
+    assert server.render_feed('unknown_feed') is None
+
+
+def test_server_publishes_snapshots_at_the_replay_speed(server):
+    assert server.recorded_interval_seconds == 60
+    assert server.published_count() == 1
+
+    # At x60, one recorded minute is published every second
+    assert server.replay_timestamp(server.start_time + 2.5) == RECORDED_TIMESTAMPS[0] + 150
+    assert server.published_at(RECORDED_TIMESTAMPS[2] + server.timestamp_offset) == server.start_time + 2
+
+
+def test_server_serves_feeds_over_http(server):
+    response = requests.get(f'{server.base_url}/station_status.json')
+
+    assert response.status_code == 200
+    assert response.json()['data']['stations'][0]['num_bikes_available'] == 0
+    assert requests.get(f'{server.base_url}/unknown_feed.json').status_code == 404
+
+
+def test_server_requires_snapshots(tmp_path):
+    with pytest.raises(Exception, match = 'No GBFS snapshot'):
+        FakeGBFSServer(snapshot_dir = str(tmp_path))
+
+
+def test_run_replay_collects_every_snapshot(monkeypatch, snapshot_dir, tmp_path_factory):
+    data_path = str(tmp_path_factory.mktemp('data'))
+    monkeypatch.setattr('pygnon.client.DATA_PATH', data_path)
+
+    report = run_replay(speed = 600, load = False, snapshot_dir = snapshot_dir)
+
+    assert report['published'] == report['processed'] == len(RECORDED_TIMESTAMPS)
+    assert report['missed'] == report['failed_loads'] == 0
+    assert not report['saturated']
+    # The throughput is not diluted by the wait for the end of the replay
+    assert report['snapshots_per_minute'] == pytest.approx(report['offered_per_minute'], rel = 0.2)
+    # The snapshots are saved in a temporary directory only
+    assert os.listdir(data_path) == []
+    assert sorted(os.listdir(snapshot_dir)) == sorted(f'gbfs_data_{ts}.json' for ts in RECORDED_TIMESTAMPS)
+
+
+def test_run_replay_injected_errors_do_not_saturate(snapshot_dir):
+    report = run_replay(speed = 600, load = False, error_rate = 0.2, snapshot_dir = snapshot_dir)
+
+    assert report['failed_collections'] > 0
+    assert report['missed'] == 0
+    assert report['processed'] + report['lost_to_errors'] == report['published']
+    assert not report['saturated']
+
+
+def test_run_replay_restores_the_database_config(monkeypatch, tmp_path):
+    configs = []
+    monkeypatch.setattr(replay, 'set_database_config', configs.append)
+    replay_config = {'database': 'myreplaydatabase', 'host': 'localhost', 'port': '5433'}
+
+    # No snapshot to replay: the server cannot start
+    with pytest.raises(Exception, match = 'No GBFS snapshot'):
+        run_replay(load = True, snapshot_dir = str(tmp_path), database_config = replay_config)
+
+    assert configs == [replay_config, DATABASE_CONFIG]
+
+
+def test_run_replay_refuses_the_main_database(monkeypatch, snapshot_dir):
+    main_config = {'database': 'mydatabase', 'host': 'localhost', 'port': '5432'}
+    monkeypatch.setattr(replay, 'DATABASE_CONFIG', main_config)
+    monkeypatch.setattr(replay, 'set_database_config', lambda config: pytest.fail('The database config should not change'))
+
+    with pytest.raises(Exception, match = 'must not be'):
+        run_replay(load = True, snapshot_dir = snapshot_dir, database_config = dict(main_config, user = 'replay'))
+
+    with pytest.raises(Exception, match = 'No replay database'):
+        run_replay(load = True, snapshot_dir = snapshot_dir, database_config = dict(main_config, database = None))
@@ -0,0 +1,38 @@
+import numpy as np
+
+from pygnon.tiles import DENSITY_COLUMNS, compute_density_tiles, get_bucket, get_cell_centers, get_cells
+
+
+def test_get_bucket():
+    assert get_bucket(1759839816, bucket_seconds = 900) == 1759839300
+    assert get_bucket(1759839300, bucket_seconds = 900) == 1759839300
+
+
+def test_get_cells_floors_positions():
+    cell_x, cell_y = get_cells([43.2999, 43.3001, -0.001], [5.4001, 5.3999, -0.001], cell_degrees = 0.1)
+
+    assert list(cell_x) == [54, 53, -1]
+    assert list(cell_y) == [432, 433, -1]
+
+
+def test_get_cell_centers_are_in_their_cells():
+    cell_x, cell_y = get_cells([43.3012], [5.3987])
+    lat, lon = get_cell_centers(cell_x, cell_y)
+
+    center_x, center_y = get_cells(lat, lon)
+    assert list(center_x) == list(cell_x) and list(center_y) == list(cell_y)
+
+
+def test_compute_density_tiles(density_gbfs):
+    tiles_df = compute_density_tiles(density_gbfs)
+
+    assert list(tiles_df.columns) == ['bucket', 'cell_x', 'cell_y'] + DENSITY_COLUMNS
+    assert (tiles_df['bucket'] == get_bucket(1759839816)).all()
+    assert len(tiles_df) == 2
+
+    tiles = tiles_df.set_index(['cell_x', 'cell_y'])
+    station_1 = tiles.loc[tuple(np.ravel(get_cells(43.3004, 5.4004)))]
+    station_2 = tiles.loc[tuple(np.ravel(get_cells(43.4002, 5.5002)))]
+
+    assert list(station_1[DENSITY_COLUMNS]) == [1, 1, 3, 10]
+    assert list(station_2[DENSITY_COLUMNS]) == [0, 0, 1, 20]